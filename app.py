@@ -1,5 +1,21 @@
+import os
+
 import dash
 
+from assets.metrics import Metrics
+from assets.model import RecommenderEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "")
+
 app = dash.Dash(__name__)
 server = app.server
 app.config.suppress_callback_exceptions = True
+
+# Loaded once per process and shared by layouts and callbacks. With gunicorn's
+# preload_app it is loaded in the master and shared by the forked workers,
+# see gunicorn.conf.py. The engine is read only after this point.
+# Set LDN_METRICS=1 to serve stage timings on /metrics.
+engine = RecommenderEngine(
+    data_dir=DATA_DIR, metrics=Metrics(enabled=os.environ.get("LDN_METRICS") == "1")
+)
+engine.freeze()
@@ -0,0 +1,46 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map: {
+        // Outlines the borough of the active cell of `dt-results` on the map in
+        // `#results-map` without reloading it, the outline comes from the map
+        highlight_borough: function(active_cell, data) {
+            var iframe = document.querySelector("#results-map iframe");
+            var win = iframe ? iframe.contentWindow : null;
+
+            if (!win || !win.ldnMap || !win.ldnOutline) {
+                return window.dash_clientside.no_update;
+            }
+
+            function clear() {
+                if (win.ldnHighlight) {
+                    win.ldnMap.removeLayer(win.ldnHighlight);
+                    win.ldnHighlight = null;
+                }
+            }
+
+            clear();
+            if (!active_cell || active_cell.column_id !== "borough" || !data) {
+                win.ldnHighlightName = null;
+                return "";
+            }
+
+            var name = data[active_cell.row].borough;
+            win.ldnHighlightName = name;
+            win.ldnOutline(name, function(latlngs) {
+                // outlines load asynchronously, only the latest selection is drawn
+                if (win.ldnHighlightName !== name || !latlngs) {
+                    return;
+                }
+                clear();
+                win.ldnHighlight = win.L.polygon(latlngs, {
+                    color: "blue",
+                    weight: 4,
+                    opacity: 1,
+                    fillOpacity: 0,
+                    interactive: false,
+                }).addTo(win.ldnMap);
+            });
+
+            return name;
+        },
+    },
+});
@@ -0,0 +1,237 @@
+"""
+Versioned columnar store for the recommender data.
+
+Every column is saved as a separate `.npy` file and loaded memory mapped, so
+processes reading the same store share its pages. Text columns are stored as
+categorical codes with their categories in a JSON file. A `manifest.json`
+describes the tables and the format version.
+
+Files are never written twice. Every write goes to a new directory `v<n>` of
+the store, and is published by replacing `manifest.json`, which names that
+directory, in one `os.replace`. Processes mapping an earlier version keep
+reading it, as long as its directory is not removed: the version before the
+published one is kept, older ones are deleted.
+
+Usage:
+    python -m assets.datastore [data_dir] [store_dir]
+
+converts the pickles in `data_dir` to a store in `store_dir`.
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 2
+MANIFEST = "manifest.json"
+
+# Tables used by the recommender and the pickles they are converted from
+PICKLES = {
+    "rents": "ldn_rents.pkl",
+    "venues": "ldn_venues_raw.pkl",
+    "groups": "ldn_groups_norm.pkl",
+}
+# BoroughLocation holds [lat, lon] lists duplicating BoroughLat and BoroughLon
+EXCLUDE = {"venues": ["BoroughLocation"]}
+
+
+def store_exists(store_dir):
+    return os.path.isfile(os.path.join(store_dir, MANIFEST))
+
+
+def read_manifest(store_dir):
+    with open(os.path.join(store_dir, MANIFEST)) as handle:
+        manifest = json.load(handle)
+
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Data store in {store_dir} has version {manifest.get('version')}, "
+            f"expected {FORMAT_VERSION}. Convert the data again with `python -m assets.datastore`."
+        )
+    return manifest
+
+
+def _write_column(values, version_dir, file_name):
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+        np.save(
+            os.path.join(version_dir, file_name + ".npy"),
+            np.ascontiguousarray(values.to_numpy()),
+        )
+        return {"kind": "numeric", "file": file_name + ".npy"}
+
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            raise TypeError(f"Column {values.name!r} has unsupported values")
+        values = values.astype("category")
+
+    np.save(
+        os.path.join(version_dir, file_name + ".npy"),
+        np.ascontiguousarray(values.cat.codes.to_numpy()),
+    )
+    with open(os.path.join(version_dir, file_name + ".json"), "w") as handle:
+        json.dump(values.cat.categories.tolist(), handle)
+    return {
+        "kind": "category",
+        "file": file_name + ".npy",
+        "categories": file_name + ".json",
+    }
+
+
+def _read_column(spec, version_dir, mmap_mode):
+    values = np.load(os.path.join(version_dir, spec["file"]), mmap_mode=mmap_mode)
+
+    if spec["kind"] == "category":
+        with open(os.path.join(version_dir, spec["categories"])) as handle:
+            categories = json.load(handle)
+        values = pd.Categorical.from_codes(
+            values, dtype=pd.CategoricalDtype(categories), validate=False
+        )
+    return values
+
+
+def _generation(directory):
+    "n of a version directory `v<n>`, None for other names"
+    if directory.startswith("v") and directory[1:].isdigit():
+        return int(directory[1:])
+    return None
+
+
+def _new_version(store_dir):
+    "Creates the next version directory of `store_dir`, returns its name"
+    generations = [_generation(d) for d in os.listdir(store_dir)]
+    generation = max([g for g in generations if g is not None], default=0) + 1
+    while True:
+        directory = f"v{generation}"
+        try:
+            os.mkdir(os.path.join(store_dir, directory))
+            return directory
+        except FileExistsError:
+            # Taken by a concurrent write
+            generation += 1
+
+
+def _remove_old_versions(store_dir, previous):
+    "Deletes the version directories written before `previous`"
+    if previous is None:
+        return
+    for directory in os.listdir(store_dir):
+        generation = _generation(directory)
+        if generation is not None and generation < _generation(previous):
+            # Files still mapped by a process are not deleted on Windows, they go next time
+            shutil.rmtree(os.path.join(store_dir, directory), ignore_errors=True)
+
+
+def write_store(tables, store_dir):
+    """
+    Writes DataFrames to a new version of the store in `store_dir` and
+    publishes it. Readers of the previous version are not affected.
+
+    Inputs:
+        tables - dictionary of table names and pandas DataFrames
+        store_dir - output directory, created if missing
+
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    previous = None
+    if store_exists(store_dir):
+        with open(os.path.join(store_dir, MANIFEST)) as handle:
+            # Manifests of version 1 have no directory, their files are left alone
+            previous = json.load(handle).get("directory")
+    directory = _new_version(store_dir)
+    version_dir = os.path.join(store_dir, directory)
+
+    manifest = {"version": FORMAT_VERSION, "directory": directory, "tables": {}}
+    for name, df in tables.items():
+        if isinstance(df.index, pd.RangeIndex):
+            index = {
+                "kind": "range",
+                "start": df.index.start,
+                "stop": df.index.stop,
+                "step": df.index.step,
+            }
+        else:
+            index = _write_column(df.index.to_series(), version_dir, f"{name}.index")
+
+        columns = []
+        for i, col in enumerate(df.columns):
+            spec = _write_column(df[col], version_dir, f"{name}.{i}")
+            spec["name"] = col
+            columns.append(spec)
+
+        manifest["tables"][name] = {"rows": len(df), "index": index, "columns": columns}
+
+    # Readers see either the previous manifest or this one, never a partial write
+    path = os.path.join(store_dir, f"{MANIFEST}.{directory}")
+    with open(path, "w") as handle:
+        json.dump(manifest, handle, indent=2)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(path, os.path.join(store_dir, MANIFEST))
+
+    _remove_old_versions(store_dir, previous)
+
+
+def read_table(store_dir, name, mmap=True):
+    """
+    Reads table `name` from `store_dir`
+
+    Inputs:
+        store_dir - directory written by `write_store`
+        name - table name
+        mmap - bool, whether column arrays are memory mapped read only
+
+    Output:
+        df - pandas DataFrame, text columns are categorical
+
+    """
+    return read_tables(store_dir, [name], mmap=mmap)[name]
+
+
+def read_tables(store_dir, names, mmap=True):
+    "Same as `read_table` for several tables, returns a dictionary of DataFrames"
+    # Files of the version named by one reading of the manifest, a later write does not mix in
+    manifest = read_manifest(store_dir)
+    version_dir = os.path.join(store_dir, manifest["directory"])
+    return {
+        name: _read_table(manifest["tables"][name], version_dir, mmap) for name in names
+    }
+
+
+def _read_table(spec, version_dir, mmap):
+    mmap_mode = "r" if mmap else None
+
+    index = spec["index"]
+    if index["kind"] == "range":
+        index = pd.RangeIndex(index["start"], index["stop"], index["step"])
+    else:
+        index = pd.Index(_read_column(index, version_dir, mmap_mode))
+
+    data = {col["name"]: _read_column(col, version_dir, mmap_mode) for col in spec["columns"]}
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def convert(data_dir, store_dir):
+    "Converts the recommender pickles in `data_dir` to a store in `store_dir`"
+    tables = {}
+    for name, pickle in PICKLES.items():
+        df = pd.read_pickle(os.path.join(data_dir, pickle))
+        tables[name] = df.drop(columns=EXCLUDE.get(name, []))
+    write_store(tables, store_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts recommender pickles to a data store")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("store_dir", nargs="?", default=None)
+    args = parser.parse_args()
+
+    store_dir = args.store_dir or os.path.join(args.data_dir, "store")
+    convert(args.data_dir, store_dir)
+    print(f"Wrote data store version {FORMAT_VERSION} to {store_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import json
+
+import numpy as np
+
+
+def polygons(geometry):
+    "Polygons of a geojson Polygon or MultiPolygon geometry as lists of rings"
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+class PreparedPolygon(object):
+    """
+    Borough outline prepared for fast point in polygon tests.
+
+    Edges of all rings are bucketed into horizontal strips of the bounding box,
+    so a point is only tested against the few edges crossing its strip. The
+    even-odd rule is used, which handles holes and multiple parts.
+
+    Inputs:
+        name - borough name
+        geometry - geojson Polygon or MultiPolygon geometry
+        n_strips - number of horizontal strips
+
+    """
+
+    def __init__(self, name, geometry, n_strips=64):
+        self.name = name
+
+        segments = []
+        for polygon in polygons(geometry):
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                segments.append(np.hstack([ring[:-1], ring[1:]]))
+        edges = np.vstack(segments)  # x1, y1, x2, y2
+        # horizontal edges never cross a horizontal ray
+        edges = edges[edges[:, 1] != edges[:, 3]]
+
+        xs = edges[:, [0, 2]]
+        ys = edges[:, [1, 3]]
+        self.bbox = (xs.min(), ys.min(), xs.max(), ys.max())
+        self.n_strips = n_strips
+        self.strip_height = (self.bbox[3] - self.bbox[1]) / n_strips or 1.0
+
+        first = self.__strip(ys.min(axis=1))
+        last = self.__strip(ys.max(axis=1))
+        counts = last - first + 1
+        edge_ids = np.repeat(np.arange(len(edges)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        strip_ids = np.repeat(first, counts) + offsets
+
+        order = np.argsort(strip_ids, kind="stable")
+        bounds = np.searchsorted(strip_ids[order], np.arange(n_strips + 1))
+        self.strips = [
+            np.ascontiguousarray(edges[edge_ids[order[bounds[s] : bounds[s + 1]]]].T)
+            for s in range(n_strips)
+        ]
+
+    def __strip(self, y):
+        strip = ((y - self.bbox[1]) // self.strip_height).astype(np.intp)
+        return np.clip(strip, 0, self.n_strips - 1)
+
+    def in_bbox(self, x, y):
+        xmin, ymin, xmax, ymax = self.bbox
+        return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+    def contains(self, x, y, chunk_size=8192):
+        """
+        Point in polygon test
+
+        Inputs:
+            x, y - numpy arrays of longitudes and latitudes
+            chunk_size - int, maximum number of points tested at once per strip
+
+        Output:
+            inside - boolean numpy array
+
+        """
+        inside = np.zeros(len(x), dtype=bool)
+        candidates = np.flatnonzero(self.in_bbox(x, y))
+        if not len(candidates):
+            return inside
+
+        strips = self.__strip(y[candidates])
+        order = np.argsort(strips, kind="stable")
+        candidates = candidates[order]
+        bounds = np.searchsorted(strips[order], np.arange(self.n_strips + 1))
+
+        for s in range(self.n_strips):
+            x1, y1, x2, y2 = self.strips[s]
+            for start in range(bounds[s], bounds[s + 1], chunk_size):
+                points = candidates[start : min(start + chunk_size, bounds[s + 1])]
+                px = x[points, None]
+                py = y[points, None]
+                crosses = (y1 > py) != (y2 > py)
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+                hits = np.count_nonzero(crosses & (px < x_cross), axis=1)
+                inside[points] = hits % 2 == 1
+        return inside
+
+
+class BoroughLocator(object):
+    """
+    Assigns points to boroughs using prepared borough outlines.
+
+    Inputs:
+        features - geojson features with a "name" property
+        n_strips - number of horizontal strips per borough, see `PreparedPolygon`
+
+    """
+
+    def __init__(self, features, n_strips=64):
+        self.polygons = [
+            PreparedPolygon(f["properties"]["name"], f["geometry"], n_strips=n_strips)
+            for f in features
+        ]
+        self.names = np.array([p.name for p in self.polygons] + [None], dtype=object)
+
+    @classmethod
+    def from_geojson(cls, file_name, **kwargs):
+        with open(file_name) as handle:
+            features = json.load(handle)["features"]
+        return cls(features, **kwargs)
+
+    def locate_codes(self, lat, lon):
+        """
+        Index in `polygons` of the borough containing each point, -1 if there is none.
+        Points on a shared border are given to the first matching borough.
+        """
+        x = np.asarray(lon, dtype=np.float64)
+        y = np.asarray(lat, dtype=np.float64)
+
+        codes = np.full(len(x), -1, dtype=np.intp)
+        for i, polygon in enumerate(self.polygons):
+            pending = np.flatnonzero(codes < 0)
+            inside = polygon.contains(x[pending], y[pending])
+            codes[pending[inside]] = i
+        return codes
+
+    def locate(self, lat, lon):
+        "Name of the borough containing each point, None if there is none"
+        return self.names[self.locate_codes(lat, lon)]
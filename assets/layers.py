@@ -0,0 +1,455 @@
+import html
+import json
+
+import numpy as np
+from branca.element import Element, MacroElement
+from jinja2 import Template
+
+
+def _subtree_names(element):
+    "Names of `element` and all of its descendants"
+    names = {element.get_name()}
+    for child in element._children.values():
+        names |= _subtree_names(child)
+    return names
+
+
+def _stable_ids(element, prefix, counter=None):
+    """
+    Replaces the random ids of `element` and its descendants with numbered
+    ones, so that the same subtree always renders to the same text
+    """
+    counter = counter if counter is not None else iter(range(1 << 30))
+    element._id = f"{prefix}{next(counter)}"
+    for child in element._children.values():
+        _stable_ids(child, prefix, counter)
+
+
+def _script_json(value):
+    "Compact JSON that is safe to embed in a script tag"
+    # "</" would end the script tag early if it was in a venue name
+    return json.dumps(value, separators=(",", ":")).replace("</", "<\\/")
+
+
+class RawElement(Element):
+    "Element that outputs `text` as is, without compiling it as a template"
+
+    def __init__(self, text):
+        super(RawElement, self).__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class PrerenderedLayer(MacroElement):
+    """
+    Map layer that is rendered to HTML and JavaScript once and then added to any
+    number of maps without being rendered again.
+
+    Use `from_element` to create the layer and `clone` to get a copy that can be
+    added to a new map, the rendered fragments are shared between clones.
+    `external` gives a copy that loads its script from a URL instead, see
+    `to_script`.
+    """
+
+    _template = Template("")
+
+    def __init__(self, header, html_parts, script_parts, script_url=None, function_name=None):
+        super(PrerenderedLayer, self).__init__()
+        self._name = "PrerenderedLayer"
+        self.header = header
+        self.html_parts = html_parts
+        self.script_parts = script_parts
+        self.script_url = script_url
+        self.function_name = function_name
+
+    @classmethod
+    def from_element(cls, element, map_obj):
+        """
+        Renders `element` on `map_obj` and keeps the output
+
+        Inputs:
+            element - folium element to prerender, e.g. `folium.Choropleth`
+            map_obj - folium Map with the same setup as the maps the layer is added to
+
+        Output:
+            layer - PrerenderedLayer
+
+        """
+        figure = map_obj.get_root()
+        figure.render()
+        map_header = set(figure.header._children)
+
+        # Rendered text is served under a hash of its content, which must
+        # not change between processes
+        _stable_ids(element, "prerendered")
+        element.add_to(map_obj)
+        figure.render()
+
+        names = _subtree_names(element)
+        map_name = map_obj.get_name()
+
+        header = [
+            (name, child.render())
+            for name, child in figure.header._children.items()
+            if name not in map_header
+        ]
+        html = "".join(
+            child.render()
+            for name, child in figure.html._children.items()
+            if name in names
+        )
+        script = "".join(
+            child.render()
+            for name, child in figure.script._children.items()
+            if name in names
+        )
+
+        # Fragments refer to the map by its name, which is different for every map
+        return cls(header, html.split(map_name), script.split(map_name))
+
+    def clone(self):
+        return PrerenderedLayer(
+            self.header,
+            self.html_parts,
+            self.script_parts,
+            self.script_url,
+            self.function_name,
+        )
+
+    def to_script(self, function_name):
+        "Script defining `function_name(map)`, which adds the layer to `map`"
+        body = "parentMap".join(self.script_parts)
+        return f"function {function_name}(parentMap) {{{body}}}\n"
+
+    def external(self, script_url, function_name):
+        "Copy that calls `function_name` from the `to_script` output served at `script_url`"
+        return PrerenderedLayer(
+            self.header, self.html_parts, self.script_parts, script_url, function_name
+        )
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        map_name = self._parent.get_name()
+
+        for name, header in self.header:
+            figure.header.add_child(RawElement(header), name=name)
+
+        figure.html.add_child(
+            RawElement(map_name.join(self.html_parts)), name=self.get_name()
+        )
+        if self.script_url is None:
+            script = map_name.join(self.script_parts)
+        else:
+            figure.header.add_child(
+                RawElement(f'<script src="{self.script_url}"></script>'),
+                name=self.get_name(),
+            )
+            script = f"{self.function_name}({map_name});"
+        figure.script.add_child(RawElement(script), name=self.get_name())
+
+
+class MapHandle(MacroElement):
+    """
+    Exposes the parent map as `window.<alias>`, so that scripts outside of the
+    map document can draw on it without knowing its generated name.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            window.{{ this.alias }} = {{ this._parent.get_name() }};
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, alias):
+        super(MapHandle, self).__init__()
+        self._name = "MapHandle"
+        self.alias = alias
+
+
+class VenueClusterLayer(MacroElement):
+    """
+    Venue layer drawn in the browser from one compact payload of clusters per
+    zoom level. Only the clusters of the current zoom inside the viewport are
+    drawn, on a canvas, and they are redrawn whenever the map moves. Zoom
+    levels past the ones in the payload are fetched for the viewport from the
+    payload's "url", maps saved outside of the app keep the last level they hold.
+
+    Inputs:
+        payload - dictionary with "groups", "colors", "min_zoom", "max_zoom",
+                  "levels" and "url", see `RecommenderEngine.venue_clusters`
+
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            var map = {{ this._parent.get_name() }};
+            var data = {{ this.payload }};
+            var renderer = L.canvas({padding: 0.25});
+            var layer = L.layerGroup().addTo(map);
+            var last = data.levels.length - 1;
+            var fetched = null, requests = 0;
+
+            function drawLevel(level) {
+                var bounds = map.getBounds().pad(0.25);
+
+                layer.clearLayers();
+                for (var i = 0; i < level.names.length; i++) {
+                    var lat = level.points[4 * i], lon = level.points[4 * i + 1];
+                    if (!bounds.contains([lat, lon])) {
+                        continue;
+                    }
+                    var count = level.points[4 * i + 2];
+                    var group = data.groups[level.points[4 * i + 3]];
+                    L.circleMarker([lat, lon], {
+                        renderer: renderer,
+                        radius: count > 1 ? Math.min(4 + 2 * Math.log2(count), 16) : 4,
+                        color: "black",
+                        weight: 1,
+                        fillColor: data.colors[level.points[4 * i + 3]],
+                        fillOpacity: 0.9
+                    }).bindTooltip(
+                        count > 1 ? count + " venues, mostly " + group : level.names[i]
+                    ).addTo(layer);
+                }
+            }
+
+            function fetchLevel(zoom) {
+                var request = ++requests;
+                var bounds = map.getBounds().pad(0.5);
+                fetch(data.url + "&zoom=" + zoom + "&bbox=" + bounds.toBBoxString())
+                    .then(function (response) {
+                        if (!response.ok) {
+                            throw new Error(response.statusText);
+                        }
+                        return response.json();
+                    })
+                    .then(function (level) {
+                        fetched = {zoom: zoom, bounds: bounds, level: level};
+                        if (request === requests) {
+                            drawLevel(level);
+                        }
+                    })
+                    .catch(function () {
+                        if (request === requests) {
+                            drawLevel(data.levels[last]);
+                        }
+                    });
+            }
+
+            function draw() {
+                var zoom = Math.round(map.getZoom());
+                zoom = Math.min(Math.max(zoom, data.min_zoom), data.max_zoom);
+                if (zoom - data.min_zoom <= last) {
+                    requests++;
+                    drawLevel(data.levels[zoom - data.min_zoom]);
+                } else if (
+                    fetched && fetched.zoom === zoom && fetched.bounds.contains(map.getBounds())
+                ) {
+                    requests++;
+                    drawLevel(fetched.level);
+                } else {
+                    fetchLevel(zoom);
+                }
+            }
+
+            map.on("zoomend moveend", draw);
+            draw();
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, payload):
+        super(VenueClusterLayer, self).__init__()
+        self._name = "VenueClusterLayer"
+        self.payload = _script_json(payload)
+
+
+class CircleMarkerLayer(MacroElement):
+    """
+    Circle markers emitted as one GeoJSON FeatureCollection, drawn in the
+    browser with a single `L.geoJSON` call instead of one script block per marker.
+
+    Inputs:
+        lat, lon - arrays of marker coordinates
+        labels - array of popup texts, escaped as HTML
+        fill_color - color of every marker, or an array of colors
+        radius - radius of every marker in pixels, or an array of radii
+        style - other Leaflet path options shared by all markers, e.g. weight
+
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            L.geoJSON({{ this.data }}, {
+                pointToLayer: function (feature, latlng) {
+                    return L.circleMarker(
+                        latlng, Object.assign({}, {{ this.style }}, feature.properties.style)
+                    );
+                },
+                onEachFeature: function (feature, layer) {
+                    layer.bindPopup(feature.properties.label);
+                }
+            }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, lat, lon, labels, fill_color="black", radius=4, **style):
+        super(CircleMarkerLayer, self).__init__()
+        self._name = "CircleMarkerLayer"
+
+        n = len(lat)
+        shared = {"fill": True, **style}
+        varying = {}
+        for key, value in [("fillColor", fill_color), ("radius", radius)]:
+            if np.ndim(value):
+                varying[key] = np.asarray(value).tolist()
+            else:
+                shared[key] = value
+
+        lon = np.round(np.asarray(lon, dtype=np.float64), 6).tolist()
+        lat = np.round(np.asarray(lat, dtype=np.float64), 6).tolist()
+        labels = [html.escape(str(label)) for label in labels]
+        styles = [dict(zip(varying, values)) for values in zip(*varying.values())]
+        if not styles:
+            styles = [{}] * n
+
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                "properties": {"label": label, "style": style},
+            }
+            for x, y, label, style in zip(lon, lat, labels, styles)
+        ]
+
+        self.data = _script_json({"type": "FeatureCollection", "features": features})
+        self.style = _script_json(shared)
+
+
+class LevelOfDetail(MacroElement):
+    """
+    Swaps the outlines of a GeoJson layer for more detailed ones when the map
+    is zoomed in. The finer levels are quantized TopoJSON files written by
+    `assets.topology`, fetched the first time they are needed. Features are
+    matched by their "name" property, so styles and events are kept.
+
+    Add it as a child of the element holding `target`, e.g. a Choropleth.
+    `window.<outline_alias>(name, callback)` passes the most detailed outline
+    of a borough to `callback`, as Leaflet latlngs.
+
+    Inputs:
+        target - folium GeoJson layer showing the coarsest level
+        levels - list of {"zoom": minimum zoom, "url": TopoJSON url}, can be empty
+        outline_alias - name of the outline function
+
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        (function () {
+            var map = {{ this._parent._parent.get_name() }};
+            var target = {{ this.target.get_name() }};
+            var levels = {{ this.levels }};
+            var shapes = {0: {}};
+            var current = 0;
+
+            target.eachLayer(function (layer) {
+                shapes[0][layer.feature.properties.name] = layer.getLatLngs();
+            });
+
+            function decode(topology) {
+                var scale = topology.transform.scale;
+                var translate = topology.transform.translate;
+                var arcs = topology.arcs.map(function (arc) {
+                    var x = 0, y = 0;
+                    return arc.map(function (point) {
+                        x += point[0];
+                        y += point[1];
+                        return [y * scale[1] + translate[1], x * scale[0] + translate[0]];
+                    });
+                });
+                function ring(refs) {
+                    var points = [];
+                    refs.forEach(function (ref) {
+                        var arc = ref >= 0 ? arcs[ref] : arcs[~ref].slice().reverse();
+                        points = points.concat(points.length ? arc.slice(1) : arc);
+                    });
+                    return points;
+                }
+                var decoded = {};
+                topology.objects.boroughs.geometries.forEach(function (geometry) {
+                    decoded[geometry.properties.name] = geometry.arcs.map(function (polygon) {
+                        return polygon.map(ring).filter(function (r) { return r.length >= 4; });
+                    }).filter(function (polygon) { return polygon.length; });
+                });
+                return decoded;
+            }
+
+            function load(level, callback) {
+                if (shapes[level.zoom]) {
+                    callback(shapes[level.zoom]);
+                    return;
+                }
+                fetch(level.url).then(function (response) {
+                    return response.json();
+                }).then(function (topology) {
+                    shapes[level.zoom] = decode(topology);
+                    callback(shapes[level.zoom]);
+                });
+            }
+
+            // Most detailed outline of a borough, for overlays drawn from outside
+            window.{{ this.outline_alias }} = function (name, callback) {
+                var finest = levels.length ? levels[levels.length - 1] : {zoom: 0};
+                load(finest, function (decoded) {
+                    callback(decoded[name]);
+                });
+            };
+
+            function show(zoom) {
+                target.eachLayer(function (layer) {
+                    var latlngs = shapes[zoom][layer.feature.properties.name];
+                    if (latlngs) {
+                        layer.setLatLngs(latlngs);
+                    }
+                });
+            }
+
+            map.on("zoomend", function () {
+                var level = {zoom: 0};
+                levels.forEach(function (l) {
+                    if (map.getZoom() >= l.zoom) {
+                        level = l;
+                    }
+                });
+                if (level.zoom === current) {
+                    return;
+                }
+                current = level.zoom;
+                load(level, function () {
+                    if (current === level.zoom) {
+                        show(level.zoom);
+                    }
+                });
+            });
+        })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, target, levels, outline_alias="ldnOutline"):
+        super(LevelOfDetail, self).__init__()
+        self._name = "LevelOfDetail"
+        self.target = target
+        self.levels = _script_json(levels)
+        self.outline_alias = outline_alias
@@ -0,0 +1,214 @@
+"""
+Latency and payload size histograms, served in the Prometheus text format.
+
+Stages are timed with
+
+    with metrics.stage("score"):
+        ...
+
+which costs a single method call when metrics are disabled. Every process
+keeps its own counters, with several gunicorn workers each of them reports
+the requests it served.
+"""
+import bisect
+import threading
+import time
+
+from flask import Response, g, request
+
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+BYTES_BUCKETS = tuple(4 ** i for i in range(4, 13))  # 256 B to 16 MB
+CALLBACK_PATH = "/_dash-update-component"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram(object):
+    "Thread safe histogram with fixed upper bounds"
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        "Cumulative (upper bound, count) pairs ending with +Inf, and the sum"
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        bounds = [_format(b) for b in self.buckets] + ["+Inf"]
+        cumulative = []
+        running = 0
+        for bound, count in zip(bounds, counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total
+
+
+class HistogramFamily(object):
+    "Histograms of one metric, one per value of its label"
+
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        histogram = self.children.get(value)
+        if histogram is None:
+            with self._lock:
+                histogram = self.children.setdefault(value, Histogram(self.buckets))
+        return histogram
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, histogram in sorted(self.children.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative, total = histogram.samples()
+            for bound, count in cumulative:
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {_format(total)}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative[-1][1]}")
+        return lines
+
+
+class _NullTimer(object):
+    "Stands in for `_Timer` when metrics are disabled"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metrics(object):
+    """
+    Stage timings, callback latencies, response sizes and cache counters.
+
+    Inputs:
+        enabled - bool, when False nothing is recorded and `register` adds no route
+        prefix - prefix of the metric names
+
+    """
+
+    def __init__(self, enabled=False, prefix="ldn"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.stages = HistogramFamily(
+            f"{prefix}_stage_seconds", "Time spent in each stage of a request", "stage",
+            SECONDS_BUCKETS,
+        )
+        self.callbacks = HistogramFamily(
+            f"{prefix}_callback_seconds",
+            "Time to answer a callback request, including serialization",
+            "callback",
+            SECONDS_BUCKETS,
+        )
+        self.payloads = HistogramFamily(
+            f"{prefix}_payload_bytes", "Size of callback responses", "callback",
+            BYTES_BUCKETS,
+        )
+        self.collectors = []
+
+    def stage(self, name):
+        "Context manager timing stage `name`"
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self.stages.labels(name))
+
+    def observe_cache(self, name, cache):
+        "Reports the counters of `LRUCache` `cache` as `name` on every scrape"
+        self.collectors.append((name, cache))
+
+    def render(self):
+        "All metrics in the Prometheus text format"
+        lines = []
+        for family in [self.stages, self.callbacks, self.payloads]:
+            lines.extend(family.render())
+
+        stats = [(name, cache.stats()) for name, cache in self.collectors]
+        for key, kind, help in [
+            ("hits", "counter", "Cache hits"),
+            ("misses", "counter", "Cache misses"),
+            ("evictions", "counter", "Entries evicted from the cache"),
+            ("size", "gauge", "Entries in the cache"),
+            ("hit_rate", "gauge", "Share of lookups answered by the cache"),
+        ]:
+            name = f"{self.prefix}_cache_{key}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for cache, values in stats:
+                lines.append(f'{name}{{cache="{_escape(cache)}"}} {_format(values[key])}')
+
+        return "\n".join(lines) + "\n"
+
+    def response(self):
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+    def register(self, server, endpoint="metrics", path="/metrics"):
+        """
+        Adds the metrics route to a Flask `server` and times its callback
+        requests. Does nothing when metrics are disabled.
+        """
+        if not self.enabled:
+            return
+
+        server.add_url_rule(path, endpoint, self.response)
+
+        @server.before_request
+        def start_timer():
+            if request.path == CALLBACK_PATH:
+                g.metrics_start = time.perf_counter()
+
+        @server.after_request
+        def observe_callback(response):
+            start = g.pop("metrics_start", None)
+            if start is not None:
+                callback = _callback_name(request.get_json(silent=True))
+                self.callbacks.labels(callback).observe(time.perf_counter() - start)
+                if not response.direct_passthrough:
+                    self.payloads.labels(callback).observe(response.content_length or 0)
+            return response
+
+
+def _callback_name(body):
+    "First output of a callback request, e.g. 'dt-results.data'"
+    if not body or "output" not in body:
+        return "unknown"
+    return body["output"].strip(".").split("...")[0]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
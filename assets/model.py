@@ -2,182 +2,629 @@ import pandas as pd
 import numpy as np
 import folium
 import json
-import copy
+import os
+from dataclasses import dataclass, replace
+from urllib.parse import urlencode
 
+from assets import datastore, topology
+from assets.cache import LRUCache
+from assets.layers import (
+    CircleMarkerLayer,
+    LevelOfDetail,
+    MapHandle,
+    PrerenderedLayer,
+    VenueClusterLayer,
+)
+from assets.metrics import Metrics
+from assets.renderer import check_cancelled
+from assets.rent_index import RentIndex
+from assets.static_files import StaticFiles
+from assets.venue_table import VenueTable
+from assets.spatial import VenueIndex, grid_clusters
 
-class BoroughRecommender(object):
+
+@dataclass(frozen=True)
+class RecommendationQuery(object):
+    """
+    Immutable set of user inputs for a single recommendation.
+
+    Inputs:
+        rent_range - a list or a tuple with r_min and r_max rent ranges
+        accommodation_types - an iterable or a string specifying appropriate accommodation types
+        ranking - venue groups in order of importance, all groups are weighted equally if empty
+        num_of_recs - int, number of boroughs to recommend
+        plot_venues - bool, whether venues of the recommended boroughs are drawn on the map
+
+    """
+
+    rent_range: tuple = (0, 3200)
+    accommodation_types: tuple = ("All categories",)
+    ranking: tuple = ()
+    num_of_recs: int = 5
+    plot_venues: bool = False
+
+    def __post_init__(self):
+        # Dash components return lists, convert them so that queries stay hashable
+        accommodation_types = self.accommodation_types
+        if isinstance(accommodation_types, str):
+            accommodation_types = [accommodation_types]
+
+        object.__setattr__(self, "rent_range", tuple(self.rent_range))
+        object.__setattr__(self, "accommodation_types", tuple(accommodation_types))
+        object.__setattr__(self, "ranking", tuple(self.ranking or ()))
+        object.__setattr__(self, "num_of_recs", int(self.num_of_recs))
+        object.__setattr__(self, "plot_venues", bool(self.plot_venues))
+
+    def normalized(self):
+        """
+        Canonical form of the query, equivalent queries are normalized to equal objects
+        so that they can share cache entries.
+        """
+        rent_lower, rent_higher = self.rent_range
+        # If invalid data provided
+        if rent_lower > rent_higher:
+            rent_higher = rent_lower
+
+        return replace(
+            self,
+            rent_range=(rent_lower, rent_higher),
+            accommodation_types=tuple(sorted(set(self.accommodation_types))),
+            ranking=tuple(dict.fromkeys(self.ranking)),
+        )
+
+    def to_dict(self):
+        "JSON serializable representation, e.g. for a `dcc.Store`"
+        return {
+            "rent_range": list(self.rent_range),
+            "accommodation_types": list(self.accommodation_types),
+            "ranking": list(self.ranking),
+            "num_of_recs": self.num_of_recs,
+            "plot_venues": self.plot_venues,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+@dataclass(frozen=True, eq=False)
+class RecommendationResult(object):
+    """
+    Output of `RecommenderEngine.recommend`.
+
+    Attributes:
+        query - the `RecommendationQuery` that produced the result
+        selected_boroughs - boroughs that satisfy the rent conditions
+        selected_groups - venue groups taken into account
+        venue_groups - all venue groups, in the order used by `preferences`
+        preferences - normalized preference vector as numpy array
+        scores - match score of every borough in `selected_boroughs`
+        recommended_boroughs - top `num_of_recs` boroughs, best match first
+        match - match scores of `recommended_boroughs`
+
+    """
+
+    query: RecommendationQuery
+    selected_boroughs: tuple
+    selected_groups: tuple
+    venue_groups: tuple
+    preferences: np.ndarray
+    scores: np.ndarray
+    recommended_boroughs: tuple
+    match: np.ndarray
+
+    @property
+    def df_preferences(self):
+        "Normalized preference vector as pandas DataFrame"
+        return pd.DataFrame(
+            {"Preference": self.preferences}, index=list(self.venue_groups)
+        )
+
+    @property
+    def df_recommendation(self):
+        "Match score of every selected borough as pandas DataFrame, highest first"
+        df_rec = pd.DataFrame(
+            {"Match": self.scores}, index=list(self.selected_boroughs)
+        )
+        return df_rec.sort_values(by="Match", ascending=False, kind="stable")
+
+
+class RecommenderEngine(object):
+    """
+    Stateless recommender. Data is loaded once and only ever read afterwards,
+    so a single engine can serve concurrent requests from many threads.
+
+    Results and rendered maps of recent queries are cached, cached objects are
+    shared between callers and must not be modified.
+
+    Stages are timed by `metrics`, a disabled `Metrics` unless one is passed.
+    """
 
     LONDON_COORDS = [51.5074, -0.1278]
     RENT_PICKLE = "ldn_rents.pkl"
     VENUES_PICKLE = "ldn_venues_raw.pkl"
     GROUPS_PICKLE = "ldn_groups_norm.pkl"
     LDN_GEOJSON = "london_boroughs_proper.geojson"
-    ACM_TYPES = [
-        "Room",
-        "Studio",
-        "One Bedroom",
-        "Two Bedroom",
-        "Three Bedroom",
-        "Four Bedroom",
-    ]
+    STORE_DIR = "store"
+    LOD_DIR = topology.LOD_DIR
+    MAP_DATA_URL = "/map-data/"
+    MAP_HANDLE = "ldnMap"
+    OUTLINE_HANDLE = "ldnOutline"
+    BASE_LAYER_FUNCTION = "ldnBaseLayer"
+    # Venues are clustered up to the last zoom and drawn one by one from there
+    CLUSTER_ZOOMS = (10, 17)
+    # Size of the cluster levels embedded in a map, deeper ones come from VENUES_URL
+    CLUSTER_BYTES = 64 * 1024
+    VENUES_URL = "/map-venues"
+    # Scores equal to this many decimals tie, ties go to the borough first in `borough_names`
+    SCORE_DECIMALS = 12
+    VENUE_COLORS = {
+        "Eating out": "#e41a1c",
+        "Entertainment": "#377eb8",
+        "Going out": "#ffff33",
+        "Green spaces": "#984ea3",
+        "Groceries": "#ff7f00",
+        "Health and Sports": "#4daf4a",
+        "Other": "#999999",
+        "Public Transport": "#a65628",
+        "Shopping": "#f781bf",
+    }
 
     def __init__(
         self,
-        data_dir=".\\",
+        data_dir=os.path.join(".", ""),
         rent_pickle=RENT_PICKLE,
         venues_pickle=VENUES_PICKLE,
         groups_pickle=GROUPS_PICKLE,
         ldn_geojson=LDN_GEOJSON,
-        num_of_recs=5,
-        auto_update=True,
-        auto_plot=True,
-        plot_venues=False,
+        store_dir=STORE_DIR,
+        lod_dir=LOD_DIR,
+        cache_size=256,
+        map_cache_size=32,
+        cache_ttl=None,
+        metrics=None,
     ):
-        self.df_rent = pd.read_pickle(data_dir + rent_pickle)
-        self.df_venues = pd.read_pickle(data_dir + venues_pickle)
-        self.df_groups = pd.read_pickle(data_dir + groups_pickle)
-        self.df_preferences = None
+        self.result_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.map_cache = LRUCache(maxsize=map_cache_size, ttl=cache_ttl)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.observe_cache("results", self.result_cache)
+        self.metrics.observe_cache("maps", self.map_cache)
+
+        # Memory mapped store is preferred, pickles are the fallback
+        store = data_dir + store_dir
+        if datastore.store_exists(store):
+            tables = datastore.read_tables(store, ["rents", "venues", "groups"])
+            self.df_rent = tables["rents"]
+            self.df_venues = tables["venues"]
+            df_groups = tables["groups"]
+        else:
+            self.df_rent = pd.read_pickle(data_dir + rent_pickle)
+            self.df_venues = pd.read_pickle(data_dir + venues_pickle)
+            df_groups = pd.read_pickle(data_dir + groups_pickle)
+        self.venue_groups = df_groups.columns.tolist()[1:]
+        self.df_groups = df_groups.set_index("Borough")
+        # Scoring works on a plain array, rows follow `self.df_groups.index`
+        self.group_matrix = np.ascontiguousarray(
+            self.df_groups[self.venue_groups].to_numpy(dtype=np.float64)
+        )
+        self.borough_names = self.df_groups.index.tolist()
+        self.borough_index = {b: i for i, b in enumerate(self.borough_names)}
+        self.rent_index = RentIndex(self.df_rent, self.borough_index)
+        self.__setup_rent_arrays()
+        self.venue_index = VenueIndex(
+            self.df_venues["Venue Latitude"].to_numpy(),
+            self.df_venues["Venue Longitude"].to_numpy(),
+            groups=self.df_venues["Group"].to_numpy(),
+        )
+        self.venue_table = VenueTable(self.df_venues)
         self.ldn_geojson = data_dir + ldn_geojson
-        self.num_of_recs = num_of_recs
-        self.auto_update = auto_update
-        self.auto_plot = auto_plot
-        self.venue_groups = self.__allowed_groups()
-        self.preferences = self.__setup_preferences()
-        self.auto_update = auto_update
-        self.selected_groups = self.venue_groups
-        self.selected_boroughs = None
-        self.recommended_boroughs = None
-        self.accommodation_types = "All categories"
-        self.rent_range = [0, 3200]
-        self.map = None
-        self.plot_venues = plot_venues
-        self.venue_legend = None
-        self.__setup_dataframes()
-        self.__initialize_map()
+        # Served by `app.server`, see `StaticFiles.register`
+        self.static_files = StaticFiles(self.MAP_DATA_URL)
+        # Simplified outlines by zoom level, the full geojson is the fallback
+        self.lod_dir = data_dir + lod_dir
+        self.lod_levels = []
+        if topology.levels_exist(self.lod_dir):
+            self.lod_levels = topology.read_levels(self.lod_dir)
+            for level in self.lod_levels:
+                with open(os.path.join(self.lod_dir, level["file"]), "rb") as handle:
+                    level["url"] = self.static_files.add(level["file"], handle.read())
+        self.borough_features = self.__index_boroughs()
+        self.base_layer = self.__create_base_layer()
+        self.base_layer_url = self.static_files.add(
+            "base_layer.js", self.base_layer.to_script(self.BASE_LAYER_FUNCTION)
+        )
 
-    def __setup_dataframes(self):
-        self.df_groups.set_index("Borough", inplace=True)
+    def __setup_rent_arrays(self):
+        "Rent table as arrays, used to filter many queries at once"
+        df = self.df_rent
+        categories = df["Category"].unique().tolist()
+        self.rent_category_index = {c: i for i, c in enumerate(categories)}
+        self.rent_category_codes = pd.Categorical(
+            df["Category"], categories=categories
+        ).codes
+        self.rent_lower = df["Lower quartile"].to_numpy(dtype=np.float64)
+        self.rent_upper = df["Upper quartile"].to_numpy(dtype=np.float64)
+        self.rent_not_null = df["Median"].notnull().to_numpy()
 
-    def __allowed_groups(self):
-        col_names = self.df_groups.columns.tolist()
-        group_names = col_names[1:]
-        return group_names
+        # Maps rent rows to borough rows
+        rows = self.borough_rows(df["Borough"].tolist())
+        self.rent_boroughs = np.zeros((len(df), len(self.borough_names)), dtype=np.float32)
+        self.rent_boroughs[np.arange(len(df)), rows] = 1
 
-    def __setup_preferences(self):
-        pref_dict = {grp: 1 for grp in self.venue_groups}
-        df = pd.DataFrame.from_dict(pref_dict, orient="index", columns=["Preference"])
-        df["Preference"] = df["Preference"] / df["Preference"].sum()
-        self.df_preferences = df
-        return pref_dict
+    def __outlines(self, level):
+        "Borough outlines as geojson, `level` 0 is the coarsest, -1 the most detailed"
+        if self.lod_levels:
+            return self.lod_levels[level]["geojson"]
+        with open(self.ldn_geojson) as handle:
+            return json.loads(handle.read())
 
-    def save_map(self, file_name):
-        if self.map is not None:
-            self.map.save(file_name)
+    def __index_boroughs(self):
+        "Maps borough names to their most detailed simplified geojson features"
+        borough_geo = self.__outlines(-1)
 
-    def __reset_preferences(self):
-        pref_dict = {grp: 0 for grp in self.venue_groups}
-        self.preferences = pref_dict
+        features = {}
+        for feature in borough_geo["features"]:
+            name = feature["properties"]["name"]
+            features[name] = {
+                "type": "Feature",
+                "properties": {"name": name},
+                "geometry": feature["geometry"],
+            }
+        return features
 
-    def _filter_rent_data(self):
+    def filter_rent_data(self, categories, rent_range):
         """
         Returns boroughs that satisfy the conditions for `categories` and `rent_range`
-            
+
         Inputs:
-            df - pandas DataFrame containing rent data -> !!! Assumes df_rent as default 
             categories - an iterable or a string specifying appropriate accommodation types
             rent_range - a list or a tuple with r_min and r_max rent ranges.
-            
+
         Output:
             boroughs - a list of boroughs that match the condition
-        
+
         """
+        with self.metrics.stage("filter"):
+            rows = self.rent_index.eligible_rows(categories, rent_range)
+            return [self.borough_names[i] for i in rows]
 
-        df = self.df_rent
-        categories = self.accommodation_types
-        rent_range = self.rent_range
+    def rank_weights(self, ranking):
+        "Converts `ranking` list to a dictionary of unnormalized group weights"
+        if not ranking:
+            return {grp: 1 for grp in self.venue_groups}
+
+        weights = {grp: 0 for grp in self.venue_groups}
+        N = len(ranking)
+        for i, cat in enumerate(ranking):
+            weights[cat] = N - i
+        return weights
+
+    def create_preferences(self, ranking):
+        "Converts `ranking` list to normalized pandas DataFrame"
+        df = pd.DataFrame.from_dict(
+            self.rank_weights(ranking), orient="index", columns=["Preference"]
+        )
+        df["Preference"] = df["Preference"] / df["Preference"].sum()
+        return df
+
+    def preference_vector(self, ranking):
+        "Converts `ranking` list to normalized numpy array in `venue_groups` order"
+        weights = self.rank_weights(ranking)
+        p = np.array([weights[grp] for grp in self.venue_groups], dtype=np.float64)
+        return p / sum(weights.values())
+
+    def borough_rows(self, boroughs):
+        "Row positions of `boroughs` in `group_matrix`"
+        return np.fromiter(
+            (self.borough_index[b] for b in boroughs), dtype=np.intp, count=len(boroughs)
+        )
+
+    def score_rows(self, rows, p, num_of_recs):
+        """
+        Scores boroughs in `rows` against preference vector `p`
+
+        Inputs:
+            rows - row positions in `group_matrix`, output of `borough_rows`
+            p - output of `preference_vector`
+            num_of_recs - int, number of boroughs to recommend
+
+        Output:
+            scores - match score of every row in `rows`
+            top - positions in `rows` of the `num_of_recs` best matches, highest first
+
+        """
+        scores = (self.group_matrix @ p)[rows]
+        keys = self.__rank_keys(scores, rows)
 
-        if isinstance(categories, str):
-            cats = [categories]
+        n = min(num_of_recs, len(scores))
+        if n <= 0:
+            return scores, np.empty(0, dtype=np.intp)
+        if n < len(scores):
+            top = np.argpartition(keys, n - 1)[:n]
         else:
-            cats = categories
+            top = np.arange(len(scores))
+        top = top[np.argsort(keys[top])]
 
-        cat_cond = df["Category"].isin(cats)
-        rent_lower = rent_range[0]
-        rent_higher = rent_range[1]
+        return scores, top
 
+    def __rank_keys(self, scores, rows):
+        """
+        Unique integer keys of `scores` of boroughs in `rows`, ascending from
+        the best match, see `SCORE_DECIMALS`. Scores computed by different
+        matrix products differ in their last bits, keys do not, so every
+        scoring path ranks boroughs the same.
+        """
+        rounded = np.round(scores * 10.0 ** self.SCORE_DECIMALS).astype(np.int64)
+        return rows - rounded * len(self.borough_names)
+
+    def score(self, boroughs, df_preferences, num_of_recs):
+        """
+        Calculates the recommendation vector
+
+        Inputs:
+            boroughs - boroughs to score, usually output of `filter_rent_data`
+            df_preferences - output of `create_preferences`
+            num_of_recs - int, number of boroughs to recommend
+
+        Output:
+            df_rec - match score of every borough sorted from highest to lowest
+            rec_boroughs - a list of `num_of_recs` best matching boroughs
+
+        """
+        with self.metrics.stage("score"):
+            p = df_preferences["Preference"].reindex(self.venue_groups).to_numpy()
+            scores, top = self.score_rows(self.borough_rows(boroughs), p, len(boroughs))
+
+            df_rec = pd.DataFrame(
+                {"Match": scores[top]}, index=[boroughs[i] for i in top]
+            )
+            rec_boroughs = df_rec.head(num_of_recs).index.tolist()
+
+        return df_rec, rec_boroughs
+
+    def recommend(self, query):
+        "Runs filter and scoring steps for `query` and returns `RecommendationResult`"
+        # Venue plotting does not change the recommendation
+        key = replace(query.normalized(), plot_venues=False)
+        result = self.result_cache.get_or_compute(key, lambda: self.__recommend(key))
+        return replace(result, query=query)
+
+    def __recommend(self, query):
+        with self.metrics.stage("filter"):
+            rows = self.rent_index.eligible_rows(
+                query.accommodation_types, query.rent_range
+            )
+            boroughs = [self.borough_names[i] for i in rows]
+        with self.metrics.stage("score"):
+            p = self.preference_vector(query.ranking)
+            scores, top = self.score_rows(
+                np.array(rows, dtype=np.intp), p, query.num_of_recs
+            )
+
+        return RecommendationResult(
+            query=query,
+            selected_boroughs=tuple(boroughs),
+            selected_groups=tuple(query.ranking or self.venue_groups),
+            venue_groups=tuple(self.venue_groups),
+            preferences=p,
+            scores=scores,
+            recommended_boroughs=tuple(boroughs[i] for i in top),
+            match=scores[top],
+        )
+
+    def rent_mask(self, queries):
+        """
+        Rent conditions of many queries as a boolean matrix, equivalent to
+        calling `filter_rent_data` for each of them
+
+        Inputs:
+            queries - a list of `RecommendationQuery`
+
+        Output:
+            mask - boolean array of shape (len(queries), number of boroughs),
+                   columns follow `borough_names`
+
+        """
+        n = len(queries)
+        rent_lower = np.array([q.rent_range[0] for q in queries], dtype=np.float64)
+        rent_higher = np.array([q.rent_range[1] for q in queries], dtype=np.float64)
         # If invalid data provided
-        if rent_lower > rent_higher:
-            rent_higher = rent_lower
+        rent_higher = np.maximum(rent_lower, rent_higher)
 
-        rent_cond = (df["Lower quartile"] <= rent_higher) & (
-            df["Upper quartile"] >= rent_lower
+        categories = np.zeros((n, len(self.rent_category_index)), dtype=bool)
+        for i, query in enumerate(queries):
+            for cat in query.accommodation_types:
+                if cat in self.rent_category_index:
+                    categories[i, self.rent_category_index[cat]] = True
+
+        rent_cond = (
+            categories[:, self.rent_category_codes]
+            & (self.rent_lower <= rent_higher[:, None])
+            & (self.rent_upper >= rent_lower[:, None])
+            & self.rent_not_null
         )
 
-        not_null = ~df["Median"].isnull()
-        df_filtered = df.loc[(cat_cond & rent_cond & not_null)]
-        boroughs = df_filtered["Borough"].unique().tolist()
+        return (rent_cond.astype(np.float32) @ self.rent_boroughs) > 0
 
-        self.selected_boroughs = boroughs
+    def recommend_many(self, queries, chunk_size=4096):
+        """
+        Scores many queries at once, equivalent to calling `recommend` for each of them
 
-        if self.auto_update:
-            self.recommend()
+        Inputs:
+            queries - an iterable of `RecommendationQuery`
+            chunk_size - int, number of queries scored with one matrix product,
+                         memory use is bounded by `chunk_size` x size of the rent table
 
-    def set_rent_range(self, rent_range):
-        self.rent_range = rent_range
-        self._filter_rent_data()
+        Output:
+            results - a list of `RecommendationResult` in the order of `queries`
 
-    def set_accommodation_types(self, acc_types):
-        self.accommodation_types = acc_types
-        self._filter_rent_data()
+        """
+        queries = list(queries)
 
-    def set_preferences(self, ranking):
-        "Converts `ranking` list to normalized pandas DataFrame"
-        self.__reset_preferences()
-        self.selected_groups = ranking
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start : start + chunk_size]
+            results.extend(self.__recommend_chunk(chunk))
+        return results
 
-        N = len(ranking)
-        for i, cat in enumerate(ranking):
-            self.preferences[cat] = N - i
+    def __recommend_chunk(self, queries):
+        n_boroughs = len(self.borough_names)
 
-        df = pd.DataFrame.from_dict(
-            self.preferences, orient="index", columns=["Preference"]
+        mask = self.rent_mask(queries)
+        P = np.array([self.preference_vector(q.ranking) for q in queries])
+
+        # One matrix product scores every borough for every query
+        S = P @ self.group_matrix.T
+        # Ranked like `score_rows`, ineligible boroughs come last
+        keys = np.where(
+            mask, self.__rank_keys(S, np.arange(n_boroughs)), np.iinfo(np.int64).max
         )
-        df["Preference"] = df["Preference"] / df["Preference"].sum()
-        self.df_preferences = df
 
-        if self.auto_update:
-            self.recommend()
+        n_max = min(max(q.num_of_recs for q in queries), n_boroughs)
+        if n_max <= 0:
+            top = np.empty((len(queries), 0), dtype=np.intp)
+        elif n_max < n_boroughs:
+            top = np.argpartition(keys, n_max - 1, axis=1)[:, :n_max]
+        else:
+            top = np.tile(np.arange(n_boroughs), (len(queries), 1))
+        order = np.argsort(np.take_along_axis(keys, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
 
-    def recommend(self):
-        "Calculates the recommendation vector"
-        W = self.df_groups.loc[self.selected_boroughs]
-        p = self.df_preferences["Preference"]
+        results = []
+        for i, query in enumerate(queries):
+            rows = np.flatnonzero(mask[i])
+            n = max(min(query.num_of_recs, len(rows)), 0)
+            best = top[i, :n]
 
-        df_rec = (p * W).sum(axis=1).to_frame()
-        df_rec.columns = ["Match"]
-        df_rec.sort_values(by="Match", ascending=False, inplace=True)
-        rec_boroughs = df_rec.head(self.num_of_recs).index.tolist()
+            results.append(
+                RecommendationResult(
+                    query=query,
+                    selected_boroughs=tuple(self.borough_names[j] for j in rows),
+                    selected_groups=tuple(query.ranking or self.venue_groups),
+                    venue_groups=tuple(self.venue_groups),
+                    preferences=P[i].copy(),
+                    scores=S[i, rows],
+                    recommended_boroughs=tuple(self.borough_names[j] for j in best),
+                    match=S[i, best],
+                )
+            )
+        return results
 
-        self.df_recommendation = df_rec
-        self.recommended_boroughs = rec_boroughs
+    def venues_near(self, lat, lon, radius, groups=None):
+        """
+        Venues within `radius` metres of a point, nearest first
 
-        if self.auto_plot:
-            self._plot_boroughs()
+        Inputs:
+            lat, lon - coordinates of the point
+            radius - distance in metres
+            groups - optional list of venue groups to keep
+
+        Output:
+            df - rows of `df_venues` with an added "Distance" column in metres
 
-    def __initialize_map(self):
         """
-        Creates map object using folium
+        positions, distances = self.venue_index.within_radius(
+            lat, lon, radius, groups=groups
+        )
+        return self.df_venues.iloc[positions].assign(Distance=distances)
+
+    def venues_in_view(self, bounds, groups=None):
         """
+        Venues inside map `bounds` given as [[south, west], [north, east]],
+        the format of Leaflet's `getBounds()`
+        """
+        (south, west), (north, east) = bounds
+        positions = self.venue_index.within_bbox(south, west, north, east, groups=groups)
+        return self.df_venues.iloc[positions]
+
+    def render_map(self, result, highlight=None, cancelled=None):
+        """
+        Creates a new folium map for `result`
+
+        Inputs:
+            result - `RecommendationResult`
+            highlight - optional name of a borough to outline on the map
+            cancelled - optional `threading.Event`, once it is set the map is
+                        abandoned with `RenderCancelled` at the next stage
+
+        Output:
+            map_ldn - folium Map object
+
+        """
+        with self.metrics.stage("create_map"):
+            map_ldn = self.create_map()
+        check_cancelled(cancelled)
+        with self.metrics.stage("plot_boroughs"):
+            df_matched = self.plot_boroughs(
+                map_ldn, result.recommended_boroughs, result.selected_groups
+            )
+
+        if result.query.plot_venues:
+            check_cancelled(cancelled)
+            with self.metrics.stage("plot_venues"):
+                self.plot_borough_venues(map_ldn, df_matched)
+
+        if highlight:
+            with self.metrics.stage("highlight"):
+                self.highlight_borough(map_ldn, highlight)
+
+        return map_ldn
+
+    def render_map_html(self, result, highlight=None, cancelled=None):
+        "Same as `render_map`, but returns the rendered HTML document as a string"
+        key = (result.query.normalized(), highlight)
+        return self.map_cache.get_or_compute(
+            key,
+            lambda: self.__render_html(
+                self.render_map(result, highlight=highlight, cancelled=cancelled),
+                cancelled,
+            ),
+        )
+
+    def __render_html(self, map_ldn, cancelled=None):
+        check_cancelled(cancelled)
+        with self.metrics.stage("render_html"):
+            return map_ldn.get_root().render()
+
+    def freeze(self):
+        """
+        Marks the lookup arrays of the engine read only. Workers forked from a
+        process holding a frozen engine share its memory, an accidental write
+        from a request would raise instead of copying pages.
+        """
+        holders = [self, self.venue_index, self.venue_table, self.venue_table.columns]
+        for holder in holders:
+            values = holder.values() if isinstance(holder, dict) else vars(holder).values()
+            for value in values:
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+
+    def cache_stats(self):
+        "Hit and miss counters of the result and map caches"
+        return {
+            "results": self.result_cache.stats(),
+            "maps": self.map_cache.stats(),
+        }
+
+    def __new_map(self):
         map_ldn = folium.Map(
             location=self.LONDON_COORDS, tiles="cartodbpositron", zoom_start=10
         )
+        # lets client side callbacks find the map inside the iframe
+        MapHandle(self.MAP_HANDLE).add_to(map_ldn)
+        return map_ldn
+
+    def __create_base_layer(self):
+        """
+        Renders the choropleth of median rents once, it is the same for every request
+        """
         df_data = self.df_rent.loc[
             self.df_rent["Category"] == "All categories", ["Borough", "Median"]
         ]
 
         # Chloropleth Map of boundaries, where shading is dependent on median rent for 'All categories'
-        folium.Choropleth(
-            geo_data=self.ldn_geojson,
+        choropleth = folium.Choropleth(
+            geo_data=self.__outlines(0),
             fill_color="BuPu",
             data=df_data,
             columns=["Borough", "Median"],
@@ -188,19 +635,49 @@ class BoroughRecommender(object):
             line_opacity=0.5,
             legend_name="Median Monthly Rent (\\xA3)",
             highlight=True,
-        ).add_to(map_ldn)
+        )
 
-        self.map = map_ldn
+        # Also lets client side callbacks outline boroughs without the full geojson
+        levels = [
+            {"zoom": level["zoom"], "url": level["url"]}
+            for level in self.lod_levels[1:]
+        ]
+        LevelOfDetail(choropleth.geojson, levels, self.OUTLINE_HANDLE).add_to(
+            choropleth
+        )
 
-    def _plot_boroughs(self):
+        return PrerenderedLayer.from_element(choropleth, self.__new_map())
+
+    def create_map(self, inline=False):
         """
-        Creates map object using folium
+        Creates map object using folium with the prerendered choropleth layer
+
+        Inputs:
+            inline - bool, whether the choropleth script is part of the map
+                     document, otherwise it is loaded from `base_layer_url`,
+                     which only works for maps shown by the app
+
         """
-        self.__initialize_map()  # to remove previous plots
+        map_ldn = self.__new_map()
+        if inline:
+            self.base_layer.clone().add_to(map_ldn)
+        else:
+            self.base_layer.external(
+                self.base_layer_url, self.BASE_LAYER_FUNCTION
+            ).add_to(map_ldn)
+
+        return map_ldn
+
+    def plot_boroughs(self, map_ldn, boroughs, groups):
+        """
+        Adds borough markers to `map_ldn`
 
+        Output:
+            df_matched - venues of `groups` located in `boroughs`
+        """
         df_matched = self.df_venues[
-            (self.df_venues["Borough"].isin(self.recommended_boroughs))
-            & (self.df_venues["Group"].isin(self.selected_groups))
+            (self.df_venues["Borough"].isin(boroughs))
+            & (self.df_venues["Group"].isin(groups))
         ]
 
         df_boroughs = df_matched[
@@ -208,73 +685,150 @@ class BoroughRecommender(object):
         ].drop_duplicates()
 
         # Add borough markers to map
-        for i, row in df_boroughs.iterrows():
-            borough = row["Borough"]
-            coords = [row["BoroughLat"], row["BoroughLon"]]
-            lbl_str = f"{borough}"  # create a label with borough name and rent range
-            label = folium.Popup(
-                lbl_str, parse_html=True
-            )  # so that the label is used as a Popup
-
-            # Add the marker
-            folium.CircleMarker(
-                coords,
-                radius=10,
-                popup=label,
-                color="black",
-                weight=1,
-                fill=True,
-                fill_color="black",
-                fill_opacity=0.75,
-                parse_html=False,
-            ).add_to(self.map)
+        CircleMarkerLayer(
+            df_boroughs["BoroughLat"].to_numpy(),
+            df_boroughs["BoroughLon"].to_numpy(),
+            df_boroughs["Borough"].astype(str).to_numpy(),
+            radius=10,
+            fill_color="black",
+            color="black",
+            weight=1,
+            fillOpacity=0.75,
+        ).add_to(map_ldn)
 
-        if self.plot_venues:
-            self._plot_borough_venues(df_matched)
+        return df_matched
+
+    def venue_clusters(self, df_venues, max_bytes=CLUSTER_BYTES):
+        """
+        Clusters of `df_venues` for every zoom level in `CLUSTER_ZOOMS`
+
+        Inputs:
+            df_venues - venues to cluster, e.g. output of `plot_boroughs`
+            max_bytes - bounds the size of the payload, levels are embedded
+                        from the first zoom while their JSON fits in `max_bytes`,
+                        deeper levels are fetched by the map for its viewport
+                        from `VENUES_URL`, see `venue_clusters_in_view`
 
+        Output:
+            payload - dictionary for `VenueClusterLayer`, each level holds flat
+                      [lat, lon, count, group] points of clusters covering every
+                      venue, and venue names of single venue clusters
 
-    def _plot_borough_venues(self, df_matched, n=10):
         """
-        Plots venues on the map
+        groups = list(self.VENUE_COLORS)
+        points = self.__venue_points(df_venues)
+
+        min_zoom, max_zoom = self.CLUSTER_ZOOMS
+        levels = []
+        size = 0
+        for zoom in range(min_zoom, max_zoom + 1):
+            level = self.__cluster_level(*points, zoom)
+            size += len(json.dumps(level, separators=(",", ":")))
+            # Clusters only split when zooming in, the first level is always kept
+            if levels and size > max_bytes:
+                break
+            levels.append(level)
+
+        # Selects the same venues as `df_venues` for the levels fetched later
+        query = [("borough", b) for b in sorted(set(df_venues["Borough"].astype(str)))]
+        query += [("group", g) for g in sorted(set(df_venues["Group"].astype(str)))]
+        return {
+            "groups": groups,
+            "colors": [self.VENUE_COLORS[g] for g in groups],
+            "min_zoom": min_zoom,
+            "max_zoom": max_zoom,
+            "levels": levels,
+            "url": self.VENUES_URL + "?" + urlencode(query),
+        }
+
+    def venue_clusters_in_view(self, bounds, zoom, boroughs, groups):
+        """
+        One level of `venue_clusters` for the venues of `groups` in `boroughs`
+        inside map `bounds`, given as [[south, west], [north, east]]
         """
-        color_map = {
-            "Eating out": "#e41a1c",
-            "Entertainment": "#377eb8",
-            "Going out": "#ffff33",
-            "Green spaces": "#984ea3",
-            "Groceries": "#ff7f00",
-            "Health and Sports": "#4daf4a",
-            "Other": "#999999",
-            "Public Transport": "#a65628",
-            "Shopping": "#f781bf",
+        min_zoom, max_zoom = self.CLUSTER_ZOOMS
+        df_venues = self.venues_in_view(bounds, groups=groups)
+        df_venues = df_venues.loc[df_venues["Borough"].isin(boroughs)]
+        return self.__cluster_level(
+            *self.__venue_points(df_venues), min(max(zoom, min_zoom), max_zoom)
+        )
+
+    def __venue_points(self, df_venues):
+        "Coordinates, group codes and names of the venues of `df_venues` in `VENUE_COLORS` groups"
+        codes = pd.Categorical(
+            df_venues["Group"], categories=list(self.VENUE_COLORS)
+        ).codes.astype(np.intp)
+        known = codes >= 0
+        lat = df_venues["Venue Latitude"].to_numpy(dtype=np.float64)[known]
+        lon = df_venues["Venue Longitude"].to_numpy(dtype=np.float64)[known]
+        names = np.asarray(df_venues["Venue"], dtype=object)[known]
+        return lat, lon, codes[known], names
+
+    def __cluster_level(self, lat, lon, codes, names, zoom):
+        "Level of `venue_clusters` at `zoom`, venues are not clustered at the last zoom"
+        if zoom >= self.CLUSTER_ZOOMS[1]:
+            clusters = {
+                "lat": lat,
+                "lon": lon,
+                "count": np.ones(len(lat), dtype=np.int64),
+                "code": codes,
+                "first": np.arange(len(lat)),
+            }
+        else:
+            clusters = grid_clusters(lat, lon, codes, zoom)
+
+        points = np.column_stack(
+            [
+                clusters["lat"].round(5),
+                clusters["lon"].round(5),
+                clusters["count"],
+                clusters["code"],
+            ]
+        )
+        single = clusters["count"] == 1
+        return {
+            "points": [
+                v if i % 4 < 2 else int(v) for i, v in enumerate(points.ravel().tolist())
+            ],
+            "names": np.where(single, names[clusters["first"]], "").tolist(),
         }
 
-        self.venue_legend = color_map
-        plotted_groups = []
-        for i, row in df_matched.iterrows():
+    def plot_borough_venues(self, map_ldn, df_matched, n=10, mode="clusters"):
+        """
+        Plots venues on the map
+
+        Inputs:
+            map_ldn - folium Map
+            df_matched - venues to plot
+            n - in "markers" mode one venue in `n` is plotted
+            mode - "clusters" draws venues clustered by zoom level from a single
+                   payload, "markers" draws one circle marker per plotted venue
+
+        Output:
+            color_map - colors used for every venue group
+        """
+        color_map = self.VENUE_COLORS
+
+        if mode == "clusters":
+            VenueClusterLayer(self.venue_clusters(df_matched)).add_to(map_ldn)
+            matched_groups = set(df_matched["Group"].astype(str))
+            plotted_groups = [g for g in color_map if g in matched_groups]
+        else:
             # let's plot only every n-th point
-            if i % n == 0:
-                continue
-            lat_i = row["Venue Latitude"]
-            lon_i = row["Venue Longitude"]
-            venue = row["Venue"]
-            group = row["Group"]
-            if group not in plotted_groups:
-                plotted_groups.append(group)
-            label = f"{venue}"  # ({group})"
-
-            coords = [lat_i, lon_i]
-            folium.CircleMarker(
-                coords,
+            df_sample = df_matched.iloc[::n]
+            groups = df_sample["Group"].astype(str)
+            plotted_groups = groups.unique().tolist()
+            CircleMarkerLayer(
+                df_sample["Venue Latitude"].to_numpy(),
+                df_sample["Venue Longitude"].to_numpy(),
+                df_sample["Venue"].to_numpy(),
                 radius=4,
-                popup=label,
+                fill_color=groups.map(color_map).to_numpy(),
                 color="black",
                 weight=1,
-                fill=True,
-                fill_color=color_map[group],
-                fill_opacity=0.9,
-                parse_html=False,
-            ).add_to(self.map)
+                fillOpacity=0.9,
+            ).add_to(map_ldn)
+
         # border-radius: 50%; overflow: hidden; border: 1px solid #000000
         # Draw legend
         # <i class="fa fa-circle" style="color:{color};border-radius: 100%; border: 3px solid rgba(0, 0, 0, .85)"></i>
@@ -290,9 +844,9 @@ class BoroughRecommender(object):
 
         legend_html = """
             <div style="
-            position: fixed; 
-            bottom: 20px; left: 20px; width: 200px; height: 160px; 
-            border:1px solid grey; z-index:9999; 
+            position: fixed;
+            bottom: 20px; left: 20px; width: 200px; height: 160px;
+            border:1px solid grey; z-index:9999;
 
             background-color:white;
             opacity: .85;
@@ -302,7 +856,7 @@ class BoroughRecommender(object):
 
             ">
             &nbsp; {title}
-            
+
 
             {itm_txt}
 
@@ -311,28 +865,297 @@ class BoroughRecommender(object):
             title="Venue Types:", itm_txt=html_items_str
         )
 
-        self.map.get_root().html.add_child(folium.Element(legend_html))
+        map_ldn.get_root().html.add_child(folium.Element(legend_html))
 
-    def highlight_borough_on_map(self, name=""):
-        if name:
+        return color_map
+
+    def highlight_borough(self, map_ldn, name):
+        "Outlines borough `name` on `map_ldn`"
+        borough = self.borough_features[name]
+
+        folium.GeoJson(borough, name=name,
+        style_function=lambda x: {
+            'color': 'blue',
+            'weight': 4,
+            "opacity": 1,
+            'fillOpacity': 0,
+            'interactive':False,
+            },
+        ).add_to(map_ldn)
+
+
+class BoroughRecommender(object):
+    """
+    Stateful wrapper around `RecommenderEngine` that keeps the selection of a
+    single user. Use `RecommenderEngine.recommend` when serving concurrent requests.
+    """
+
+    LONDON_COORDS = RecommenderEngine.LONDON_COORDS
+    RENT_PICKLE = RecommenderEngine.RENT_PICKLE
+    VENUES_PICKLE = RecommenderEngine.VENUES_PICKLE
+    GROUPS_PICKLE = RecommenderEngine.GROUPS_PICKLE
+    LDN_GEOJSON = RecommenderEngine.LDN_GEOJSON
+    STORE_DIR = RecommenderEngine.STORE_DIR
+    ACM_TYPES = [
+        "Room",
+        "Studio",
+        "One Bedroom",
+        "Two Bedroom",
+        "Three Bedroom",
+        "Four Bedroom",
+    ]
+    UPDATE_PARAMS = [
+        "rent_range",
+        "accommodation_types",
+        "ranking",
+        "num_of_recs",
+        "plot_venues",
+    ]
+
+    def __init__(
+        self,
+        data_dir=os.path.join(".", ""),
+        rent_pickle=RENT_PICKLE,
+        venues_pickle=VENUES_PICKLE,
+        groups_pickle=GROUPS_PICKLE,
+        ldn_geojson=LDN_GEOJSON,
+        store_dir=STORE_DIR,
+        num_of_recs=5,
+        auto_update=True,
+        auto_plot=True,
+        plot_venues=False,
+        engine=None,
+    ):
+        if engine is None:
+            engine = RecommenderEngine(
+                data_dir=data_dir,
+                rent_pickle=rent_pickle,
+                venues_pickle=venues_pickle,
+                groups_pickle=groups_pickle,
+                ldn_geojson=ldn_geojson,
+                store_dir=store_dir,
+            )
+        self.engine = engine
+        self.df_rent = engine.df_rent
+        self.df_venues = engine.df_venues
+        self.df_groups = engine.df_groups
+        self.df_preferences = None
+        self.ldn_geojson = engine.ldn_geojson
+        self.num_of_recs = num_of_recs
+        self.auto_update = auto_update
+        self.auto_plot = auto_plot
+        self.venue_groups = engine.venue_groups
+        self.preferences = self.__setup_preferences()
+        self.selected_groups = self.venue_groups
+        self.selected_boroughs = None
+        self.recommended_boroughs = None
+        self.accommodation_types = "All categories"
+        self.rent_range = [0, 3200]
+        self.map = None
+        self.plot_venues = plot_venues
+        self.venue_legend = None
+        self.recomputations_avoided = 0
+        self._pending = None  # stages deferred by `update`, None outside of a batch
+        self._requested = 0
+        self.__initialize_map()
+
+    def __setup_preferences(self):
+        self.df_preferences = self.engine.create_preferences(None)
+        return self.engine.rank_weights(None)
+
+    def save_map(self, file_name):
+        if self.map is not None:
+            with self.engine.metrics.stage("save_map"):
+                self.map.save(file_name)
+
+    def get_map_html(self):
+        "Rendered map as a HTML string, None if there is no map"
+        if self.map is not None:
+            with self.engine.metrics.stage("render_html"):
+                return self.map.get_root().render()
+
+    def __cascade(self, stage):
+        "Number of recalculations `stage` triggers outside of a batch"
+        if stage == "filter":
+            return 1 + (self.__cascade("score") if self.auto_update else 0)
+        if stage == "score":
+            return 1 + (self.__cascade("plot") if self.auto_plot else 0)
+        return 1
+
+    def __defer(self, stage):
+        "Stages `stage` if a batch is open, returns True when deferred"
+        if self._pending is None:
+            return False
+        self._pending.add(stage)
+        self._requested += self.__cascade(stage)
+        return True
+
+    def update(self, **params):
+        """
+        Stages new selection parameters without recalculating anything.
+        Setters called before `apply` are deferred as well.
+
+        Inputs:
+            rent_range, accommodation_types, ranking, num_of_recs, plot_venues
+
+        Output:
+            self, so that `brec.update(...).apply()` can be chained
+
+        """
+        unknown = set(params) - set(self.UPDATE_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        if self._pending is None:
+            self._pending = set()
+
+        if "rent_range" in params:
+            self.set_rent_range(params["rent_range"])
+        if "accommodation_types" in params:
+            self.set_accommodation_types(params["accommodation_types"])
+        if "ranking" in params:
+            self.set_preferences(params["ranking"])
+        # Plain attributes never triggered a recalculation on their own
+        if "num_of_recs" in params:
+            self.num_of_recs = params["num_of_recs"]
+            self._pending.add("score")
+        if "plot_venues" in params:
+            self.plot_venues = params["plot_venues"]
+            self._pending.add("plot")
+
+        return self
+
+    def apply(self):
+        """
+        Runs the staged filter, scoring and plotting steps, each at most once.
+
+        Output:
+            avoided - number of recalculations saved compared to running
+                      every setter call immediately
+
+        """
+        return self.__apply()[0]
+
+    def __apply(self):
+        "Same as `apply`, also returns whether the map was plotted"
+        if self._pending is None:
+            return 0, False
+
+        stages = self._pending
+        requested = self._requested
+        self._pending = None
+        self._requested = 0
+
+        runs = 0
+        plotted = False
+        if "filter" in stages or self.selected_boroughs is None:
+            self.selected_boroughs = self.engine.filter_rent_data(
+                self.accommodation_types, self.rent_range
+            )
+            stages.add("score")
+            runs += 1
+        if "score" in stages:
+            self.__score()
+            stages.add("plot")
+            runs += 1
+        if "plot" in stages and self.auto_plot:
             self._plot_boroughs()
-            with open(self.ldn_geojson) as handle:
-                borough_geo = json.loads(handle.read())
-
-            for feature in borough_geo["features"]:
-                if feature["properties"]["name"] == name:
-                    borough = feature
-                    break
-
-            folium.GeoJson(borough, name=name,
-            style_function=lambda x: {
-                'color': 'blue',
-                'weight': 4,
-                "opacity": 1,
-                'fillOpacity': 0,
-                'interactive':False,
-                },
-            ).add_to(self.map)
-        else:
+            runs += 1
+            plotted = True
+
+        avoided = max(requested - runs, 0)
+        self.recomputations_avoided += avoided
+        return avoided, plotted
+
+    def _filter_rent_data(self):
+        """
+        Updates `selected_boroughs` with boroughs that satisfy the conditions
+        for `accommodation_types` and `rent_range`
+
+        """
+        if self.__defer("filter"):
+            return
+
+        self.selected_boroughs = self.engine.filter_rent_data(
+            self.accommodation_types, self.rent_range
+        )
+
+        if self.auto_update:
+            self.recommend()
+
+    def set_rent_range(self, rent_range):
+        self.rent_range = rent_range
+        self._filter_rent_data()
+
+    def set_accommodation_types(self, acc_types):
+        self.accommodation_types = acc_types
+        self._filter_rent_data()
+
+    def set_preferences(self, ranking):
+        "Converts `ranking` list to normalized pandas DataFrame"
+        self.selected_groups = ranking
+        self.preferences = self.engine.rank_weights(ranking)
+        self.df_preferences = self.engine.create_preferences(ranking)
+
+        if self.auto_update:
+            self.recommend()
+
+    def recommend(self):
+        "Calculates the recommendation vector"
+        if self.__defer("score"):
+            return
+
+        self.__score()
+
+        if self.auto_plot:
             self._plot_boroughs()
 
+    def __score(self):
+        df_rec, rec_boroughs = self.engine.score(
+            self.selected_boroughs, self.df_preferences, self.num_of_recs
+        )
+
+        self.df_recommendation = df_rec
+        self.recommended_boroughs = rec_boroughs
+
+    def __initialize_map(self):
+        """
+        Creates map object using folium
+        """
+        with self.engine.metrics.stage("create_map"):
+            self.map = self.engine.create_map(inline=True)
+
+    def _plot_boroughs(self):
+        """
+        Creates map object using folium
+        """
+        if self.__defer("plot"):
+            return
+
+        self.__initialize_map()  # to remove previous plots
+
+        with self.engine.metrics.stage("plot_boroughs"):
+            df_matched = self.engine.plot_boroughs(
+                self.map, self.recommended_boroughs, self.selected_groups
+            )
+
+        if self.plot_venues:
+            self._plot_borough_venues(df_matched)
+
+    def _plot_borough_venues(self, df_matched, n=10, mode="clusters"):
+        """
+        Plots venues on the map
+        """
+        with self.engine.metrics.stage("plot_venues"):
+            self.venue_legend = self.engine.plot_borough_venues(
+                self.map, df_matched, n=n, mode=mode
+            )
+
+    def highlight_borough_on_map(self, name=""):
+        # highlight is drawn on top of an up to date map without earlier highlights
+        _, plotted = self.__apply()
+        if not plotted:
+            self._plot_boroughs()
+        if name:
+            with self.engine.metrics.stage("highlight"):
+                self.engine.highlight_borough(self.map, name)
@@ -0,0 +1,328 @@
+"""
+Pipeline stages that rebuild the datasets loaded by the recommender.
+
+Usage:
+    python -m assets.pipeline venues venues.csv [--boroughs B ...] [--data-dir data] [--store-dir data/store]
+    python -m assets.pipeline groups [--boroughs B ...] [--data-dir data] [--store-dir data/store]
+
+`venues` reads a dump with "Venue", "Venue Category", "Venue Latitude" and
+"Venue Longitude" columns, and optionally "Group", assigns the venues to
+boroughs with `BoroughLocator` and replaces the venues of the store. `groups`
+recomputes the normalized group matrix from the venues of the store.
+
+Both stages keep raw venue counts in the "group_counts" table. With `--boroughs`
+only the venues of the listed boroughs are replaced and recounted, the other
+rows of the matrix come from the stored counts.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from assets import datastore
+from assets.geometry import BoroughLocator
+
+LDN_GEOJSON = "london_boroughs_proper.geojson"
+CHUNK_SIZE = 100000
+VENUE_COLUMNS = [
+    "Venue",
+    "Borough",
+    "Venue Category",
+    "Group",
+    "Venue Latitude",
+    "Venue Longitude",
+    "BoroughLat",
+    "BoroughLon",
+]
+
+
+def load_tables(data_dir, store_dir):
+    "All recommender tables, from the store if it exists, otherwise from the pickles"
+    if datastore.store_exists(store_dir):
+        names = list(datastore.read_manifest(store_dir)["tables"])
+        # Memory mapped, writes publish a new version and leave these files alone
+        return datastore.read_tables(store_dir, names)
+
+    return {
+        name: pd.read_pickle(os.path.join(data_dir, pickle)).drop(
+            columns=datastore.EXCLUDE.get(name, [])
+        )
+        for name, pickle in datastore.PICKLES.items()
+    }
+
+
+def iter_chunks(df, chunk_size=CHUNK_SIZE):
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size]
+
+
+def read_venues(file_name, chunk_size=CHUNK_SIZE):
+    "Iterates over a CSV or pickle venue dump in chunks of `chunk_size` rows"
+    if file_name.endswith(".pkl"):
+        return iter_chunks(pd.read_pickle(file_name), chunk_size)
+    return pd.read_csv(file_name, chunksize=chunk_size)
+
+
+def relabel_venues(df_venues, locator, borough_centres, category_groups=None, drop_outside=True):
+    """
+    Assigns venues to boroughs by their coordinates
+
+    Inputs:
+        df_venues - pandas DataFrame of venues
+        locator - `BoroughLocator`
+        borough_centres - pandas DataFrame indexed by borough with "BoroughLat" and "BoroughLon"
+        category_groups - dictionary mapping venue categories to groups, used when
+                          `df_venues` has no "Group" column, unknown categories go to "Other"
+        drop_outside - bool, whether venues outside of every borough are dropped
+
+    Output:
+        df - venues with "Borough", "BoroughLat" and "BoroughLon" columns filled in
+
+    """
+    df = df_venues.copy()
+    df["Borough"] = locator.locate(
+        df["Venue Latitude"].to_numpy(), df["Venue Longitude"].to_numpy()
+    )
+    if drop_outside:
+        df = df.loc[df["Borough"].notnull()]
+
+    if "Group" not in df.columns:
+        df["Group"] = df["Venue Category"].map(category_groups or {}).fillna("Other")
+
+    centres = borough_centres.reindex(df["Borough"])
+    df["BoroughLat"] = centres["BoroughLat"].to_numpy()
+    df["BoroughLon"] = centres["BoroughLon"].to_numpy()
+
+    return df[VENUE_COLUMNS].reset_index(drop=True)
+
+
+def count_groups(chunks, boroughs, groups):
+    """
+    Number of venues per borough and group, counted chunk by chunk
+
+    Inputs:
+        chunks - iterable of DataFrames with "Borough" and "Group" columns
+        boroughs - boroughs to count, in output order
+        groups - venue groups to count, in output order
+
+    Output:
+        df - pandas DataFrame with a "Borough" column and one count column per group
+
+    """
+    borough_index = pd.Index(boroughs)
+    group_index = pd.Index(groups)
+
+    counts = np.zeros(len(boroughs) * len(groups), dtype=np.int64)
+    for chunk in chunks:
+        b = borough_index.get_indexer(np.asarray(chunk["Borough"], dtype=object))
+        g = group_index.get_indexer(np.asarray(chunk["Group"], dtype=object))
+        known = (b >= 0) & (g >= 0)
+        counts += np.bincount(
+            b[known] * len(groups) + g[known], minlength=len(counts)
+        )
+
+    df = pd.DataFrame(counts.reshape(len(boroughs), len(groups)), columns=groups)
+    df.insert(0, "Borough", list(boroughs))
+    return df
+
+
+def merge_group_counts(df_counts, df_new):
+    """
+    Replaces the rows of `df_counts` with those of `df_new`, boroughs missing
+    from `df_counts` are added
+
+    Inputs:
+        df_counts, df_new - outputs of `count_groups` with the same groups
+
+    """
+    groups = df_counts.columns.tolist()[1:]
+    df = df_counts.astype({"Borough": str}).set_index("Borough")
+    new = df_new.astype({"Borough": str}).set_index("Borough")[groups]
+
+    df = df.reindex(df.index.union(new.index, sort=False), fill_value=0)
+    df.loc[new.index, groups] = new.to_numpy()
+    return df.reset_index()
+
+
+def update_group_counts(df_counts, df_venues, boroughs, chunk_size=CHUNK_SIZE):
+    """
+    Recounts the venues of `boroughs` only, other rows of `df_counts` are kept
+
+    Inputs:
+        df_counts - output of `count_groups`
+        df_venues - venues, only those in `boroughs` are read
+        boroughs - boroughs whose venues changed, may include boroughs that
+                   are not in `df_counts` yet
+
+    """
+    groups = df_counts.columns.tolist()[1:]
+    df_changed = df_venues.loc[df_venues["Borough"].isin(boroughs)]
+    df_new = count_groups(iter_chunks(df_changed, chunk_size), boroughs, groups)
+    return merge_group_counts(df_counts, df_new)
+
+
+def normalize_counts(df_counts):
+    """
+    Normalized venue group density of every borough, the `W` matrix of the recommender.
+    Every row sums to 1 unless the borough has no venues.
+    """
+    counts = df_counts.astype({"Borough": str}).set_index("Borough")
+    totals = counts.sum(axis=1).replace(0, np.nan)
+    df = counts.div(totals, axis=0).fillna(0.0)
+    return df.reset_index()
+
+
+def compute_group_matrix(df_venues, boroughs, groups, chunk_size=CHUNK_SIZE):
+    """
+    Normalized venue group density of every borough
+
+    Inputs:
+        df_venues - venues with "Borough" and "Group" columns
+        boroughs - boroughs to include, in output order
+        groups - venue groups to include, in output order
+
+    Output:
+        df - pandas DataFrame with a "Borough" column and one column per group
+
+    """
+    counts = count_groups(iter_chunks(df_venues, chunk_size), boroughs, groups)
+    return normalize_counts(counts)
+
+
+def _setup(tables):
+    "Boroughs and groups of the group matrix"
+    boroughs = tables["groups"]["Borough"].astype(str).tolist()
+    groups = tables["groups"].columns.tolist()[1:]
+    return boroughs, groups
+
+
+def _replace_venues(df_old, df_new, boroughs):
+    "Venues of `boroughs` from `df_new`, the rest from `df_old`"
+    if boroughs is None:
+        return df_new
+    df_kept = df_old.loc[~df_old["Borough"].isin(boroughs)]
+    df_new = df_new.loc[df_new["Borough"].isin(boroughs)]
+    return pd.concat([df_kept, df_new], ignore_index=True)
+
+
+def _collect(chunks, collected):
+    "Passes `chunks` through, appending them to `collected`"
+    for chunk in chunks:
+        collected.append(chunk)
+        yield chunk
+
+
+def _write_groups(tables, store_dir, boroughs, chunk_size, new_counts=None):
+    """
+    Updates group counts and the group matrix, then writes the store. Counts
+    come from `new_counts` when the venues were already counted, otherwise from
+    the venues table.
+    """
+    all_boroughs, groups = _setup(tables)
+    df_venues = tables["venues"]
+
+    if new_counts is not None and (boroughs is None or "group_counts" in tables):
+        counts = new_counts
+        if boroughs is not None:
+            counts = merge_group_counts(tables["group_counts"], new_counts)
+    elif boroughs is None or "group_counts" not in tables:
+        counts = count_groups(iter_chunks(df_venues, chunk_size), all_boroughs, groups)
+    else:
+        counts = update_group_counts(
+            tables["group_counts"], df_venues, boroughs, chunk_size
+        )
+
+    tables["group_counts"] = counts
+    tables["groups"] = normalize_counts(counts)
+    # Published as a new version, engines mapping the current one keep working
+    datastore.write_store(tables, store_dir)
+    return tables
+
+
+def rebuild(venues_file, data_dir, store_dir, boroughs=None, chunk_size=CHUNK_SIZE):
+    """
+    Relabels venues in `venues_file` and replaces the venues and groups tables of
+    the store in `store_dir`
+
+    Inputs:
+        venues_file - CSV or pickle venue dump
+        data_dir - directory with the borough geojson and the pickles
+        store_dir - data store to update
+        boroughs - optional list of boroughs, only their venues are replaced
+        chunk_size - int, number of rows processed at once
+
+    """
+    tables = load_tables(data_dir, store_dir)
+    df_old = tables["venues"]
+
+    borough_centres = (
+        df_old[["Borough", "BoroughLat", "BoroughLon"]]
+        .drop_duplicates("Borough")
+        .astype({"Borough": str})
+        .set_index("Borough")
+    )
+    category_groups = dict(
+        zip(df_old["Venue Category"].astype(str), df_old["Group"].astype(str))
+    )
+
+    locator = BoroughLocator.from_geojson(os.path.join(data_dir, LDN_GEOJSON))
+    known, groups = _setup(tables)
+    if boroughs is None:
+        # boroughs of the outlines that have no venues yet get rows as well
+        located = [name for name in locator.names if name is not None]
+        count_boroughs = known + [b for b in located if b not in set(known)]
+    else:
+        count_boroughs = list(boroughs)
+
+    # Chunks are relabeled and counted as they are read, only the relabeled
+    # venues that are kept stay in memory
+    def relabeled():
+        for chunk in read_venues(venues_file, chunk_size):
+            df = relabel_venues(chunk, locator, borough_centres, category_groups)
+            if boroughs is not None:
+                df = df.loc[df["Borough"].isin(boroughs)]
+            yield df
+
+    kept = []
+    new_counts = count_groups(_collect(relabeled(), kept), count_boroughs, groups)
+    df_new = pd.concat(kept, ignore_index=True) if kept else df_old.iloc[:0]
+
+    tables["venues"] = _replace_venues(df_old, df_new, boroughs)
+    return _write_groups(tables, store_dir, boroughs, chunk_size, new_counts)
+
+
+def rebuild_groups(data_dir, store_dir, boroughs=None, chunk_size=CHUNK_SIZE):
+    """
+    Recomputes the group matrix of the store from its venues table, only the rows
+    of `boroughs` when given
+    """
+    tables = load_tables(data_dir, store_dir)
+    return _write_groups(tables, store_dir, boroughs, chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuilds recommender data")
+    parser.add_argument("stage", choices=["venues", "groups"])
+    parser.add_argument("venues_file", nargs="?")
+    parser.add_argument("--boroughs", nargs="+", default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--store-dir", default=None)
+    args = parser.parse_args()
+
+    store_dir = args.store_dir or os.path.join(args.data_dir, "store")
+    if args.stage == "venues":
+        if not args.venues_file:
+            parser.error("the venues stage needs a venues file")
+        tables = rebuild(
+            args.venues_file, args.data_dir, store_dir, args.boroughs, args.chunk_size
+        )
+    else:
+        tables = rebuild_groups(args.data_dir, store_dir, args.boroughs, args.chunk_size)
+
+    print(f"Wrote {len(tables['venues'])} venues and {len(tables['groups'])} boroughs to {store_dir}")
+
+
+if __name__ == "__main__":
+    main()
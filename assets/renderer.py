@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+
+class RenderCancelled(Exception):
+    "Raised by a render that was superseded by a newer one of the same client"
+
+
+def check_cancelled(cancelled):
+    "Raises `RenderCancelled` once the `threading.Event` `cancelled` is set"
+    if cancelled is not None and cancelled.is_set():
+        raise RenderCancelled()
+
+
+class MapRenderer(object):
+    """
+    Renders maps on a bounded pool of threads, keeping at most one render per
+    client. A new render cancels the previous one of its client: a render that
+    has not started is dropped, a running one stops at its next stage.
+
+    Renders are only cancelled by requests served by the same process, which
+    needs a threaded server such as the gthread workers of gunicorn.conf.py.
+    Threads are started by the first render, so a renderer created before
+    gunicorn forks its workers holds no threads in the master.
+
+    Inputs:
+        max_workers - number of maps rendered at the same time
+
+    """
+
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="map-render"
+        )
+        self.renders = {}  # client -> (future, cancelled event) of its latest render
+        self.superseded = 0
+        self._lock = threading.Lock()
+
+    def submit(self, client, func):
+        """
+        Schedules `func(cancelled)` for `client`, `cancelled` is a
+        `threading.Event` set when a newer render of `client` is submitted
+
+        Output:
+            future - `concurrent.futures.Future` of the result of `func`
+        """
+        cancelled = threading.Event()
+        with self._lock:
+            previous = self.renders.get(client)
+            if previous is not None:
+                future, previous_cancelled = previous
+                previous_cancelled.set()
+                future.cancel()
+                self.superseded += 1
+            future = self.executor.submit(func, cancelled)
+            self.renders[client] = (future, cancelled)
+
+        future.add_done_callback(lambda f: self.__forget(client, f))
+        return future
+
+    def render(self, client, func):
+        """
+        Same as `submit`, but waits for the result. Raises `RenderCancelled`
+        if the render is superseded before it finishes.
+        """
+        try:
+            return self.submit(client, func).result()
+        except CancelledError:
+            raise RenderCancelled()
+
+    def __forget(self, client, future):
+        with self._lock:
+            latest = self.renders.get(client)
+            if latest is not None and latest[0] is future:
+                del self.renders[client]
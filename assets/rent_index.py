@@ -0,0 +1,89 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class RentIndex(object):
+    """
+    Precomputed index answering which boroughs have rents in a given range.
+
+    For every accommodation category the rent rows are sorted by lower and by
+    upper quartile, with cumulative borough bitsets along both orders. A query
+    is then two binary searches and a bitwise AND per category, it is exact for
+    any rent range.
+
+    Inputs:
+        df_rent - rent data with "Borough", "Category", quartile and "Median" columns
+        borough_index - dictionary mapping borough names to bit positions
+
+    """
+
+    def __init__(self, df_rent, borough_index):
+        self.categories = {}
+
+        df = df_rent.loc[
+            df_rent["Median"].notnull()
+            & df_rent["Lower quartile"].notnull()
+            & df_rent["Upper quartile"].notnull()
+        ]
+        for category, df_cat in df.groupby("Category", sort=False):
+            bits = [1 << borough_index[b] for b in df_cat["Borough"]]
+            lower = df_cat["Lower quartile"].to_numpy(dtype=np.float64)
+            upper = df_cat["Upper quartile"].to_numpy(dtype=np.float64)
+
+            # lower_bits[k] - boroughs among the k rows with the smallest lower quartile
+            lower_order = np.argsort(lower, kind="stable")
+            lower_bits = [0]
+            for i in lower_order:
+                lower_bits.append(lower_bits[-1] | bits[i])
+
+            # upper_bits[k] - boroughs among rows from k onwards in upper quartile order
+            upper_order = np.argsort(upper, kind="stable")
+            upper_bits = [0]
+            for i in upper_order[::-1]:
+                upper_bits.append(upper_bits[-1] | bits[i])
+            upper_bits.reverse()
+
+            self.categories[category] = (
+                lower[lower_order].tolist(),
+                lower_bits,
+                upper[upper_order].tolist(),
+                upper_bits,
+            )
+
+    def eligible_bits(self, categories, rent_range):
+        """
+        Boroughs with any of `categories` whose quartile range overlaps `rent_range`
+
+        Output:
+            bits - int, bit i is set if borough with index i matches
+        """
+        if isinstance(categories, str):
+            categories = [categories]
+
+        rent_lower, rent_higher = rent_range
+        # If invalid data provided
+        if rent_lower > rent_higher:
+            rent_higher = rent_lower
+
+        bits = 0
+        for category in categories:
+            if category not in self.categories:
+                continue
+            lower, lower_bits, upper, upper_bits = self.categories[category]
+            bits |= (
+                lower_bits[bisect_right(lower, rent_higher)]
+                & upper_bits[bisect_left(upper, rent_lower)]
+            )
+        return bits
+
+    def eligible_rows(self, categories, rent_range):
+        "Same as `eligible_bits`, but returns sorted borough indices"
+        bits = self.eligible_bits(categories, rent_range)
+
+        rows = []
+        while bits:
+            low = bits & -bits
+            rows.append(low.bit_length() - 1)
+            bits ^= low
+        return rows
@@ -0,0 +1,194 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # metres
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    "Great circle distance in metres, works on numpy arrays"
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class VenueIndex(object):
+    """
+    Uniform grid over venue coordinates for radius and bounding box queries.
+
+    Venues are sorted by grid cell, so the venues of a row of cells form one
+    contiguous slice. A query only looks at the cells overlapping its bounding
+    box and filters those candidates exactly.
+
+    Inputs:
+        lat, lon - venue coordinates in degrees
+        groups - optional venue group of every venue, used by `groups` filters
+        cell_size - approximate cell edge in metres
+
+    """
+
+    def __init__(self, lat, lon, groups=None, cell_size=250):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+
+        self.lat_min = lat.min() if len(lat) else 0.0
+        self.lon_min = lon.min() if len(lon) else 0.0
+        mid_lat = math.radians((lat.max() + lat.min()) / 2) if len(lat) else 0.0
+        self.cell_lat = math.degrees(cell_size / EARTH_RADIUS)
+        self.cell_lon = self.cell_lat / max(math.cos(mid_lat), 1e-6)
+
+        cy = ((lat - self.lat_min) // self.cell_lat).astype(np.intp)
+        cx = ((lon - self.lon_min) // self.cell_lon).astype(np.intp)
+        self.ny = int(cy.max()) + 1 if len(lat) else 1
+        self.nx = int(cx.max()) + 1 if len(lon) else 1
+
+        cell = cy * self.nx + cx
+        # positions of venues in input order, sorted by cell
+        self.order = np.argsort(cell, kind="stable")
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+        self.cell_start = np.searchsorted(
+            cell[self.order], np.arange(self.nx * self.ny + 1)
+        )
+
+        self.group_names = None
+        if groups is not None:
+            codes, names = _factorize(groups)
+            self.group_codes = codes[self.order]
+            self.group_names = {name: i for i, name in enumerate(names)}
+
+    def __cell_range(self, value, origin, step, n):
+        return min(max(int((value - origin) // step), 0), n - 1)
+
+    def __candidates(self, south, west, north, east):
+        "Sorted positions of venues in cells overlapping the bounding box"
+        if north < self.lat_min or east < self.lon_min:
+            return np.empty(0, dtype=np.intp)
+
+        y0 = self.__cell_range(south, self.lat_min, self.cell_lat, self.ny)
+        y1 = self.__cell_range(north, self.lat_min, self.cell_lat, self.ny)
+        x0 = self.__cell_range(west, self.lon_min, self.cell_lon, self.nx)
+        x1 = self.__cell_range(east, self.lon_min, self.cell_lon, self.nx)
+
+        rows = np.arange(y0, y1 + 1) * self.nx
+        starts = self.cell_start[rows + x0]
+        ends = self.cell_start[rows + x1 + 1]
+        if len(starts) == 1:
+            return np.arange(starts[0], ends[0])
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+    def __filter_groups(self, candidates, groups):
+        if groups is None:
+            return candidates
+        codes = [self.group_names[g] for g in groups if g in self.group_names]
+        return candidates[np.isin(self.group_codes[candidates], codes)]
+
+    def within_bbox(self, south, west, north, east, groups=None):
+        """
+        Venues inside a bounding box, e.g. the map viewport
+
+        Inputs:
+            south, west, north, east - bounding box in degrees
+            groups - optional iterable of venue groups to keep
+
+        Output:
+            positions - row positions of matching venues in the input data
+
+        """
+        candidates = self.__candidates(south, west, north, east)
+        lat = self.lat[candidates]
+        lon = self.lon[candidates]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        candidates = self.__filter_groups(candidates[inside], groups)
+        return self.order[candidates]
+
+    def within_radius(self, lat, lon, radius, groups=None, sort=True):
+        """
+        Venues within `radius` metres of a point
+
+        Inputs:
+            lat, lon - centre of the search in degrees
+            radius - search radius in metres
+            groups - optional iterable of venue groups to keep
+            sort - bool, whether results are ordered from the nearest
+
+        Output:
+            positions - row positions of matching venues in the input data
+            distances - distances in metres
+
+        """
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        max_lat = math.radians(min(abs(lat) + d_lat, 89.9))
+        d_lon = d_lat / math.cos(max_lat)
+
+        candidates = self.__candidates(lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon)
+        candidates = self.__filter_groups(candidates, groups)
+
+        distances = haversine(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+
+        if sort:
+            nearest = np.argsort(distances, kind="stable")
+            candidates, distances = candidates[nearest], distances[nearest]
+        return self.order[candidates], distances
+
+
+def _factorize(values):
+    "Integer codes and unique values of `values`"
+    names, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return codes.ravel(), names.tolist()
+
+
+def mercator_pixels(lat, lon, zoom=0):
+    "Web mercator pixel coordinates of points at `zoom`, as used by map tiles"
+    scale = 256.0 * 2 ** zoom
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * scale
+    return x, y
+
+
+def grid_clusters(lat, lon, codes, zoom, cell_px=48):
+    """
+    Aggregates points into square cells of `cell_px` screen pixels at `zoom`
+
+    Inputs:
+        lat, lon - numpy arrays of point coordinates in degrees
+        codes - numpy array of integer group codes of the points
+        zoom - map zoom level
+        cell_px - cell edge in pixels
+
+    Output:
+        clusters - dictionary of numpy arrays, "lat" and "lon" of the cluster
+                   centroids, "count", the most common group "code" and "first",
+                   the position of one point of the cluster, sorted by count.
+                   Every point is in one cluster.
+
+    """
+    x, y = mercator_pixels(lat, lon, zoom)
+    cx = (x // cell_px).astype(np.int64)
+    cy = (y // cell_px).astype(np.int64)
+
+    cells, first, inverse = np.unique(
+        cx * (2 ** 32) + cy, return_index=True, return_inverse=True
+    )
+    inverse = inverse.ravel()
+    count = np.bincount(inverse, minlength=len(cells))
+
+    n_codes = int(codes.max()) + 1 if len(codes) else 1
+    per_code = np.bincount(
+        inverse * n_codes + codes, minlength=len(cells) * n_codes
+    ).reshape(len(cells), n_codes)
+
+    keep = np.argsort(-count, kind="stable")
+    return {
+        "lat": (np.bincount(inverse, weights=lat, minlength=len(cells)) / count)[keep],
+        "lon": (np.bincount(inverse, weights=lon, minlength=len(cells)) / count)[keep],
+        "count": count[keep],
+        "code": per_code.argmax(axis=1)[keep],
+        "first": first[keep],
+    }
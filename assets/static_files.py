@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+MIMETYPES = {".js": "application/javascript", ".topojson": "application/json"}
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StaticFile(object):
+    "Content of a static file with its precompressed encodings"
+
+    def __init__(self, content, mimetype):
+        self.digest = hashlib.sha256(content).hexdigest()[:16]
+        self.mimetype = mimetype
+        self.encodings = {"identity": content, "gzip": gzip.compress(content, 9)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(content, quality=11)
+
+        # a compressed version that is not smaller is not worth sending
+        for encoding in list(self.encodings):
+            if len(self.encodings[encoding]) >= len(content):
+                if encoding != "identity":
+                    del self.encodings[encoding]
+
+
+class StaticFiles(object):
+    """
+    In memory static files served under content hashed names.
+
+    Files are compressed with gzip, and brotli when it is installed, once when
+    they are added. As a name changes with the content, responses are cached
+    by browsers for good, and conditional requests get 304 responses.
+
+    Inputs:
+        url_prefix - URL path the files are served from, e.g. "/map-data/"
+
+    """
+
+    def __init__(self, url_prefix):
+        self.url_prefix = url_prefix
+        self.files = {}
+        self.urls = {}
+
+    def add(self, name, content, mimetype=None):
+        """
+        Adds a file and returns its URL
+
+        Inputs:
+            name - file name, the content hash is added before its extension
+            content - bytes or str, str is encoded as UTF-8
+            mimetype - optional, guessed from the extension by default
+
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+
+        root, ext = os.path.splitext(name)
+        if mimetype is None:
+            mimetype = MIMETYPES.get(ext) or mimetypes.guess_type(name)[0]
+        entry = StaticFile(content, mimetype or "application/octet-stream")
+
+        hashed_name = f"{root}.{entry.digest}{ext}"
+        self.files[hashed_name] = entry
+        self.urls[name] = self.url_prefix + hashed_name
+        return self.urls[name]
+
+    def url(self, name):
+        return self.urls[name]
+
+    def response(self, hashed_name):
+        "Response for a request of `hashed_name`, in the best encoding the client accepts"
+        entry = self.files.get(hashed_name)
+        if entry is None:
+            abort(404)
+
+        encoding = request.accept_encodings.best_match(
+            [e for e in ("br", "gzip") if e in entry.encodings]
+        )
+        encoding = encoding or "identity"
+
+        response = Response(entry.encodings[encoding], mimetype=entry.mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        # every encoding is a different representation with its own tag
+        response.set_etag(entry.digest if encoding == "identity" else f"{entry.digest}-{encoding}")
+        return response.make_conditional(request)
+
+    def register(self, server, endpoint="static_files"):
+        "Adds the route serving the files to a Flask `server`"
+        server.add_url_rule(
+            self.url_prefix + "<path:hashed_name>", endpoint, self.response
+        )
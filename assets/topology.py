@@ -0,0 +1,329 @@
+"""
+Simplified, quantized borough outlines at several levels of detail.
+
+The outlines are split into arcs at the points where neighbouring boroughs
+meet, so every shared border is stored once and simplified once. Neighbours
+then still share exactly the same simplified border, without gaps or
+overlaps. Arcs are simplified with Douglas-Peucker, quantized and delta
+encoded as TopoJSON, one file per level.
+
+Usage:
+    python -m assets.topology [data_dir]
+
+writes the levels of `data_dir/london_boroughs_proper.geojson` to `data_dir/lod`.
+"""
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from assets.geometry import polygons
+from assets.spatial import EARTH_RADIUS
+
+LDN_GEOJSON = "london_boroughs_proper.geojson"
+LOD_DIR = "lod"
+INDEX = "index.json"
+QUANTIZATION = 100000
+# Each level is used from `zoom` onwards, tolerances are about half a pixel there
+LEVELS = [
+    {"zoom": 0, "tolerance": 40.0},
+    {"zoom": 12, "tolerance": 10.0},
+    {"zoom": 14, "tolerance": 2.5},
+]
+
+
+def _rings(features):
+    "Rings of every feature as lists of coordinate tuples, grouped by polygon"
+    shapes = []
+    for feature in features:
+        shapes.append(
+            [
+                [[tuple(point[:2]) for point in ring] for ring in polygon]
+                for polygon in polygons(feature["geometry"])
+            ]
+        )
+    return shapes
+
+
+def _junctions(shapes):
+    "Points where a ring meets a ring with different neighbours, arcs are cut there"
+    neighbours = {}
+    for shape in shapes:
+        for polygon in shape:
+            for ring in polygon:
+                n = len(ring) - 1
+                for i in range(n):
+                    pair = frozenset((ring[i - 1 if i else n - 1], ring[i + 1]))
+                    neighbours.setdefault(ring[i], set()).add(pair)
+    return {point for point, pairs in neighbours.items() if len(pairs) > 1}
+
+
+def _canonical(arc):
+    "Key of an arc that is the same for the arc and its reverse"
+    if arc[0] == arc[-1]:
+        # closed arc without junctions, the start point is arbitrary
+        ring = arc[:-1]
+        start = ring.index(min(ring))
+        forward = tuple(ring[start:] + ring[:start])
+        backward = tuple(reversed(forward[1:] + forward[:1]))
+        return min(forward, backward), forward != min(forward, backward)
+    key = tuple(arc)
+    reverse = tuple(reversed(arc))
+    return min(key, reverse), key != min(key, reverse)
+
+
+def build_topology(features):
+    """
+    Splits borough outlines into shared arcs
+
+    Inputs:
+        features - geojson features of Polygons or MultiPolygons
+
+    Output:
+        arcs - list of numpy arrays of [lon, lat] points
+        shapes - for every feature, polygons as lists of rings, rings as lists of
+                 arc indices, ~i for arc i reversed as in TopoJSON
+
+    """
+    shapes = _rings(features)
+    junctions = _junctions(shapes)
+
+    arcs = []
+    arc_ids = {}
+    topology = []
+    for shape in shapes:
+        polygons = []
+        for polygon in shape:
+            rings = []
+            for ring in polygon:
+                points = ring[:-1]
+                cuts = [i for i, point in enumerate(points) if point in junctions]
+                if cuts:
+                    points = points[cuts[0] :] + points[: cuts[0]]
+                    cuts = [i - cuts[0] for i in cuts] + [len(points)]
+                    points = points + points[:1]
+                    pieces = [points[a : b + 1] for a, b in zip(cuts[:-1], cuts[1:])]
+                else:
+                    pieces = [points + points[:1]]
+
+                refs = []
+                for piece in pieces:
+                    key, reversed_ = _canonical(piece)
+                    if key not in arc_ids:
+                        arc_ids[key] = len(arcs)
+                        # arcs are stored in their canonical direction
+                        arcs.append(piece[::-1] if reversed_ else piece)
+                    elif arcs[arc_ids[key]][0] == arcs[arc_ids[key]][-1]:
+                        # closed arcs only need the right orientation
+                        reversed_ = _orientation(arcs[arc_ids[key]]) != _orientation(piece)
+                    refs.append(~arc_ids[key] if reversed_ else arc_ids[key])
+                rings.append(refs)
+            polygons.append(rings)
+        topology.append(polygons)
+
+    return [np.array(arc, dtype=np.float64) for arc in arcs], topology
+
+
+def _orientation(ring):
+    "Sign of the shoelace area of a closed ring"
+    xy = np.asarray(ring, dtype=np.float64)
+    area = np.sum(xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1])
+    return area > 0
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Douglas-Peucker line simplification, the end points are always kept
+
+    Inputs:
+        points - numpy array of [x, y] points in metres
+        tolerance - largest distance of a dropped point from the simplified line
+
+    Output:
+        keep - boolean numpy array of kept points
+
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        inner = points[start + 1 : end]
+        ab = b - a
+        length = math.hypot(ab[0], ab[1])
+        if length == 0:
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / length
+        farthest = int(np.argmax(dist))
+        if dist[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_arcs(arcs, tolerance):
+    "Simplifies every arc with `douglas_peucker`, `tolerance` is in metres"
+    origin_lat = np.mean([arc[:, 1].mean() for arc in arcs])
+    scale = np.array([math.cos(math.radians(origin_lat)), 1.0]) * math.radians(EARTH_RADIUS)
+
+    simplified = []
+    for arc in arcs:
+        xy = arc * scale
+        if len(arc) > 3 and np.array_equal(arc[0], arc[-1]):
+            # a closed arc is split at its farthest point, so that it keeps an area
+            far = int(np.argmax(np.hypot(*(xy - xy[0]).T)))
+            keep = np.concatenate(
+                [douglas_peucker(xy[: far + 1], tolerance)[:-1], douglas_peucker(xy[far:], tolerance)]
+            )
+        else:
+            keep = douglas_peucker(xy, tolerance)
+        simplified.append(arc[keep])
+    return simplified
+
+
+def encode(arcs, shapes, names, quantization=QUANTIZATION):
+    """
+    Quantized, delta encoded TopoJSON of `arcs` and `shapes`
+
+    Inputs:
+        arcs, shapes - output of `build_topology`, arcs possibly simplified
+        names - borough name of every shape
+        quantization - number of distinct positions along each axis
+
+    Output:
+        topology - TopoJSON dictionary with a "boroughs" GeometryCollection
+
+    """
+    points = np.vstack(arcs)
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    scale = (hi - lo) / (quantization - 1)
+
+    encoded = []
+    for arc in arcs:
+        q = np.round((arc - lo) / scale).astype(np.int64)
+        delta = np.diff(q, axis=0)
+        # quantization can merge consecutive points
+        delta = delta[np.any(delta != 0, axis=1)]
+        encoded.append(np.vstack([q[:1], delta]).tolist())
+
+    geometries = [
+        {"type": "MultiPolygon", "arcs": shape, "properties": {"name": name}}
+        for shape, name in zip(shapes, names)
+    ]
+    return {
+        "type": "Topology",
+        "transform": {"scale": scale.tolist(), "translate": lo.tolist()},
+        "objects": {"boroughs": {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": encoded,
+    }
+
+
+def decode(topology, digits=6):
+    """
+    GeoJSON FeatureCollection of a topology written by `encode`.
+    Rings that collapsed to less than three distinct points are dropped.
+    """
+    scale = np.array(topology["transform"]["scale"])
+    translate = np.array(topology["transform"]["translate"])
+    arcs = [
+        np.round(np.cumsum(np.array(arc, dtype=np.float64), axis=0) * scale + translate, digits)
+        for arc in topology["arcs"]
+    ]
+
+    def ring(refs):
+        points = []
+        for ref in refs:
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            points.extend(arc.tolist()[1 if points else 0 :])
+        return points
+
+    features = []
+    for geometry in topology["objects"]["boroughs"]["geometries"]:
+        polygons = []
+        for polygon in geometry["arcs"]:
+            rings = [ring(refs) for refs in polygon]
+            rings = [r for r in rings if len(r) >= 4]
+            if rings:
+                polygons.append(rings)
+        features.append(
+            {
+                "type": "Feature",
+                "properties": geometry["properties"],
+                "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_levels(geojson_file, lod_dir, levels=LEVELS, quantization=QUANTIZATION):
+    """
+    Writes one TopoJSON file per level of detail and an index of the levels
+
+    Output:
+        index - list of levels with "zoom", "tolerance" and "file"
+    """
+    with open(geojson_file) as handle:
+        features = json.load(handle)["features"]
+    names = [f["properties"]["name"] for f in features]
+    arcs, shapes = build_topology(features)
+
+    os.makedirs(lod_dir, exist_ok=True)
+    index = []
+    for level in levels:
+        topology = encode(simplify_arcs(arcs, level["tolerance"]), shapes, names, quantization)
+        file_name = f"boroughs_z{level['zoom']}.topojson"
+        with open(os.path.join(lod_dir, file_name), "w") as handle:
+            json.dump(topology, handle, separators=(",", ":"))
+        index.append({**level, "file": file_name})
+
+    with open(os.path.join(lod_dir, INDEX), "w") as handle:
+        json.dump(index, handle, indent=2)
+    return index
+
+
+def levels_exist(lod_dir):
+    return os.path.isfile(os.path.join(lod_dir, INDEX))
+
+
+def read_levels(lod_dir):
+    """
+    Levels of detail written by `write_levels`
+
+    Output:
+        levels - list of levels with "zoom", "file" and the decoded "geojson",
+                 from the coarsest
+    """
+    with open(os.path.join(lod_dir, INDEX)) as handle:
+        index = json.load(handle)
+
+    levels = []
+    for level in sorted(index, key=lambda level: level["zoom"]):
+        with open(os.path.join(lod_dir, level["file"])) as handle:
+            levels.append({**level, "geojson": decode(json.load(handle))})
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes simplified borough outlines")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    args = parser.parse_args()
+
+    lod_dir = os.path.join(args.data_dir, LOD_DIR)
+    index = write_levels(os.path.join(args.data_dir, LDN_GEOJSON), lod_dir)
+    for level in index:
+        size = os.path.getsize(os.path.join(lod_dir, level["file"]))
+        print(f"zoom {level['zoom']:>2}+: {level['file']} {size / 1000:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
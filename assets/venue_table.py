@@ -0,0 +1,158 @@
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+MAPS_URL = "https://www.google.com/maps/search/?api=1&query="
+# Operators of DataTable filter queries, each with the symbol that stands for it
+FILTER_OPERATORS = [
+    ["ge", ">="],
+    ["le", "<="],
+    ["lt", "<"],
+    ["gt", ">"],
+    ["ne", "!="],
+    ["eq", "="],
+    ["contains"],
+    ["datestartswith"],
+]
+OPERATOR_NAMES = {op: names[0] for names in FILTER_OPERATORS for op in names}
+COMPARISONS = {
+    "ge": operator.ge,
+    "le": operator.le,
+    "lt": operator.lt,
+    "gt": operator.gt,
+    "ne": operator.ne,
+    "eq": operator.eq,
+}
+# "{column} operator value", the operator is the token after the column
+FILTER_PART = re.compile(r"^\{(.+?)\}\s+(\S+)\s+(.*)$")
+
+
+def split_filter_part(filter_part):
+    """
+    Column, operator and value of one part of a DataTable `filter_query`,
+    e.g. '{Venue} contains "Park"'. Returns [None, None, None] if it cannot be parsed.
+    """
+    match = FILTER_PART.match(filter_part.strip())
+    if match is None or match.group(2) not in OPERATOR_NAMES:
+        return [None] * 3
+    name, op, value_part = match.groups()
+
+    value_part = value_part.strip()
+    v0 = value_part[0] if value_part else ""
+    if v0 and v0 == value_part[-1] and v0 in ("'", '"', "`") and len(value_part) > 1:
+        value = value_part[1:-1].replace("\\" + v0, v0)
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+
+    return name, OPERATOR_NAMES[op], value
+
+
+class VenueTable(object):
+    """
+    Venues sorted by borough and group once, so that the venues of a group in
+    a borough are one contiguous slice. The venues of a borough in any group
+    ranking are the slices of its groups in rank order, without sorting.
+    Serves the venue table of the app one page at a time, with DataTable
+    filter queries applied on the server.
+
+    Inputs:
+        df_venues - venues with "Borough", "Venue", "Group", "Venue Category",
+                    "Venue Latitude" and "Venue Longitude" columns
+
+    """
+
+    COLUMNS = ["Venue", "Group", "Venue Category"]
+
+    def __init__(self, df_venues):
+        boroughs = pd.Categorical(df_venues["Borough"])
+        groups = pd.Categorical(df_venues["Group"])
+        n_groups = len(groups.categories)
+
+        key = boroughs.codes.astype(np.intp) * n_groups + groups.codes
+        order = np.argsort(key, kind="stable")
+
+        self.borough_index = {b: i for i, b in enumerate(boroughs.categories)}
+        self.group_index = {g: i for i, g in enumerate(groups.categories)}
+        # slice_start[b, g] is the first row of group g in borough b
+        starts = np.searchsorted(
+            key[order], np.arange(len(boroughs.categories) * n_groups + 1)
+        )
+        self.slice_start = starts[:-1].reshape(len(boroughs.categories), n_groups)
+        self.slice_end = starts[1:].reshape(len(boroughs.categories), n_groups)
+
+        self.columns = {
+            col: np.asarray(df_venues[col], dtype=object)[order] for col in self.COLUMNS
+        }
+        self.lat = df_venues["Venue Latitude"].to_numpy(dtype=np.float64)[order]
+        self.lon = df_venues["Venue Longitude"].to_numpy(dtype=np.float64)[order]
+
+    def rows(self, borough, groups):
+        """
+        Positions of the venues of `borough` in `groups`, ordered by the rank
+        of their group in `groups`
+        """
+        b = self.borough_index.get(borough)
+        codes = [self.group_index[g] for g in groups if g in self.group_index]
+        if b is None or not codes:
+            return np.empty(0, dtype=np.intp)
+
+        return np.concatenate(
+            [np.arange(self.slice_start[b, g], self.slice_end[b, g]) for g in codes]
+        )
+
+    def filter(self, rows, filter_query):
+        "Keeps `rows` matching a DataTable `filter_query`"
+        if not filter_query:
+            return rows
+
+        for part in filter_query.split(" && "):
+            name, op, value = split_filter_part(part)
+            if name not in self.columns:
+                continue
+            values = pd.Series(self.columns[name][rows], dtype=object).astype(str)
+            value = str(value)
+            if op == "contains":
+                keep = values.str.contains(value, case=False, regex=False)
+            elif op == "datestartswith":
+                keep = values.str.startswith(value)
+            else:
+                keep = COMPARISONS[op](values, value)
+            rows = rows[keep.to_numpy(dtype=bool)]
+        return rows
+
+    def page(self, rows, page_current, page_size):
+        """
+        Records of one page of `rows` for a DataTable, with a Google Maps link
+        formatted for the venues on the page only
+
+        Output:
+            records - list of dictionaries
+            page_count - number of pages of `rows`
+        """
+        page_count = max(-(-len(rows) // page_size), 1)
+        page_rows = rows[page_current * page_size : (page_current + 1) * page_size]
+
+        data = {col: values[page_rows] for col, values in self.columns.items()}
+        data["URL"] = np.char.add(
+            np.char.add("[Link to Maps](", self.map_links(page_rows)), ")"
+        ).astype(object)
+
+        return pd.DataFrame(data).to_dict(orient="records"), page_count
+
+    def map_links(self, rows):
+        "Google Maps links to the venues of `rows`"
+        coords = np.char.add(
+            np.char.add(self.lat[rows].astype(str), ","), self.lon[rows].astype(str)
+        )
+        return np.char.add(MAPS_URL, coords)
+
+    def to_csv(self, rows):
+        "All venues of `rows` as CSV text, with the table's columns and a link to each venue"
+        data = {col: values[rows] for col, values in self.columns.items()}
+        data["URL"] = self.map_links(rows)
+        return pd.DataFrame(data).to_csv(index=False)
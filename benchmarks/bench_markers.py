@@ -0,0 +1,92 @@
+"""
+Compares venue markers built row by row with `iterrows` and `folium.CircleMarker`,
+as `plot_borough_venues` used to, with the columnar `CircleMarkerLayer`.
+
+Venues are sampled with replacement from the venue data and slightly moved,
+so any number of them can be generated.
+
+Usage:
+    python -m benchmarks.bench_markers [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import time
+
+import folium
+import numpy as np
+
+from assets.layers import CircleMarkerLayer
+from assets.model import RecommenderEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "")
+
+
+def synthetic_venues(engine, n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = engine.df_venues.iloc[rng.integers(0, len(engine.df_venues), n)]
+    df = df.reset_index(drop=True)
+    df["Venue Latitude"] = df["Venue Latitude"] + rng.normal(0, 0.002, n)
+    df["Venue Longitude"] = df["Venue Longitude"] + rng.normal(0, 0.003, n)
+    return df
+
+
+def iterrows_markers(engine, df_venues):
+    "Markers as previously added by `plot_borough_venues`"
+    map_ldn = folium.Map(location=engine.LONDON_COORDS, tiles=None)
+    for i, row in df_venues.iterrows():
+        folium.CircleMarker(
+            [row["Venue Latitude"], row["Venue Longitude"]],
+            radius=4,
+            popup=f"{row['Venue']}",
+            color="black",
+            weight=1,
+            fill=True,
+            fill_color=engine.VENUE_COLORS[row["Group"]],
+            fill_opacity=0.9,
+            parse_html=False,
+        ).add_to(map_ldn)
+    return map_ldn
+
+
+def columnar_markers(engine, df_venues):
+    map_ldn = folium.Map(location=engine.LONDON_COORDS, tiles=None)
+    CircleMarkerLayer(
+        df_venues["Venue Latitude"].to_numpy(),
+        df_venues["Venue Longitude"].to_numpy(),
+        df_venues["Venue"].to_numpy(),
+        radius=4,
+        fill_color=df_venues["Group"].astype(str).map(engine.VENUE_COLORS).to_numpy(),
+        color="black",
+        weight=1,
+        fillOpacity=0.9,
+    ).add_to(map_ldn)
+    return map_ldn
+
+
+def measure(func, engine, df_venues):
+    "Seconds to build and render the map, and the size of the HTML"
+    start = time.perf_counter()
+    html = func(engine, df_venues).get_root().render()
+    return time.perf_counter() - start, len(html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+
+    print(f"{'venues':>8} {'iterrows':>10} {'columnar':>10} {'speedup':>8} {'html':>16}")
+    for n in args.sizes:
+        df_venues = synthetic_venues(engine, n)
+        old_time, old_size = measure(iterrows_markers, engine, df_venues)
+        new_time, new_size = measure(columnar_markers, engine, df_venues)
+        print(
+            f"{n:>8} {old_time:>9.2f}s {new_time:>9.2f}s {old_time / new_time:>7.1f}x "
+            f"{old_size / 1e6:>6.1f} -> {new_size / 1e6:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
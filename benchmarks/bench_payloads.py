@@ -0,0 +1,117 @@
+"""
+JSON response size of every interaction of the results section, measured by
+posting callback requests to the Dash server like the browser does.
+
+Run from the repository root, where the app finds its data:
+    python -m benchmarks.bench_payloads
+"""
+import argparse
+import json
+import time
+
+import index  # noqa: F401, sets the layout and registers the callbacks
+from app import app
+
+DEFAULT_VALUES = {
+    "btn-recommend.n_clicks": 1,
+    "chk-acm-types.value": ["Room", "Studio"],
+    "slider-rent.value": [400, 1200],
+    "dpn-venue-types.value": ["Shopping", "Eating out", "Green spaces"],
+    "dpn-number-of-recs.value": 5,
+    "chk-display-venues.value": [],
+    "store-client.data": None,
+}
+
+
+def callback_body(output, values, changed):
+    """
+    Body of a `_dash-update-component` request
+
+    Inputs:
+        output - callback output as registered in `app.callback_map`, or any
+                 part of it, e.g. "map-frame.srcDoc"
+        values - dictionary of "id.property" and values of inputs and states
+        changed - list of "id.property" that triggered the callback
+
+    """
+    key = next(k for k in app.callback_map if output in k)
+    callback = app.callback_map[key]
+
+    def props(items):
+        return [
+            {**item, "value": values.get(f"{item['id']}.{item['property']}")}
+            for item in items
+        ]
+
+    outputs = [
+        {"id": o.split(".")[0], "property": o.split(".")[1]}
+        for o in key.strip(".").split("...")
+    ]
+    return {
+        "output": key,
+        "outputs": outputs if key.startswith("..") else outputs[0],
+        "inputs": props(callback["inputs"]),
+        "state": props(callback.get("state", [])),
+        "changedPropIds": changed,
+    }
+
+
+def post(client, output, values, changed):
+    "Posts a callback request, returns the response and the seconds it took"
+    start = time.perf_counter()
+    response = client.post(
+        "/_dash-update-component", json=callback_body(output, values, changed)
+    )
+    return response, time.perf_counter() - start
+
+
+def interactions(client, values):
+    "Runs the interactions of the results section in order, yields their responses"
+    response, seconds = post(client, "dt-results.data", values, ["btn-recommend.n_clicks"])
+    yield "recommend", response, seconds
+
+    result = json.loads(response.data)["response"]
+    values = {
+        **values,
+        "dt-results.data": result["dt-results"]["data"],
+        "store-query.data": result["store-query"]["data"],
+        "store-client.data": result["store-client"]["data"],
+    }
+    response, seconds = post(client, "map-frame.srcDoc", values, ["store-query.data"])
+    yield "recommend, map", response, seconds
+
+    values["dt-results.active_cell"] = {"row": 0, "column": 0, "column_id": "borough"}
+    response, seconds = post(client, "dt-rents.data", values, ["dt-results.active_cell"])
+    yield "row click, details", response, seconds
+
+    values.update({"dt-venues.page_current": 0, "dt-venues.page_size": 20, "dt-venues.filter_query": ""})
+    response, seconds = post(client, "dt-venues.data", values, ["dt-results.active_cell"])
+    yield "row click, venues", response, seconds
+
+    values["dt-venues.page_current"] = 1
+    response, seconds = post(client, "dt-venues.data", values, ["dt-venues.page_current"])
+    yield "venues next page", response, seconds
+
+    values.update({"dt-venues.page_current": 0, "dt-venues.filter_query": '{Venue} contains "park"'})
+    response, seconds = post(client, "dt-venues.data", values, ["dt-venues.filter_query"])
+    yield "venues filter", response, seconds
+
+    values["chk-display-venues.value"] = ["Y"]
+    response, seconds = post(client, "dt-results.data", values, ["btn-recommend.n_clicks"])
+    values["store-query.data"] = json.loads(response.data)["response"]["store-query"]["data"]
+    response, seconds = post(client, "map-frame.srcDoc", values, ["store-query.data"])
+    yield "recommend with venues, map", response, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.parse_args()
+
+    client = app.server.test_client()
+    print(f"{'interaction':<28} {'status':>6} {'bytes':>10} {'ms':>8}")
+    for name, response, seconds in interactions(client, DEFAULT_VALUES):
+        print(f"{name:<28} {response.status_code:>6} {len(response.data):>10} {seconds * 1e3:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
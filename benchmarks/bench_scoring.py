@@ -0,0 +1,58 @@
+"""
+Compares the pandas scoring path `recommend()` used to run with the numpy core
+of `RecommenderEngine`.
+
+Usage:
+    python -m benchmarks.bench_scoring [--repeat N]
+"""
+import argparse
+import os
+import timeit
+
+from assets.model import RecommenderEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "")
+RANKING = ["Shopping", "Eating out", "Green spaces", "Public Transport"]
+
+
+def pandas_score(engine, boroughs, ranking, num_of_recs):
+    "Scoring as previously done by `BoroughRecommender.recommend`"
+    W = engine.df_groups.loc[boroughs]
+    p = engine.create_preferences(ranking)["Preference"]
+
+    df_rec = (p * W).sum(axis=1).to_frame()
+    df_rec.columns = ["Match"]
+    df_rec.sort_values(by="Match", ascending=False, inplace=True)
+    return df_rec.head(num_of_recs).index.tolist()
+
+
+def numpy_score(engine, boroughs, ranking, num_of_recs):
+    p = engine.preference_vector(ranking)
+    scores, top = engine.score_rows(engine.borough_rows(boroughs), p, num_of_recs)
+    return [boroughs[i] for i in top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+    boroughs = engine.filter_rent_data(["Room", "Studio"], [400, 1200])
+
+    expected = pandas_score(engine, boroughs, RANKING, 5)
+    assert numpy_score(engine, boroughs, RANKING, 5) == expected
+
+    timings = {}
+    for name, func in [("pandas", pandas_score), ("numpy", numpy_score)]:
+        total = timeit.timeit(
+            lambda: func(engine, boroughs, RANKING, 5), number=args.repeat
+        )
+        timings[name] = total / args.repeat * 1e6
+        print(f"{name:>8}: {timings[name]:10.1f} us per call")
+
+    print(f" speedup: {timings['pandas'] / timings['numpy']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Timings of the recommender steps and of the Dash callbacks, on the shipped
+data and on synthetic data scaled to more boroughs and venues.
+
+Scaled data copies every borough, with its rents, group shares and venues,
+`scale` times. Copies are moved to a grid around London so that they do not
+overlap on the map. The data is written to a temporary directory as pickles
+and outlines, like `data/`, and loaded by a separate engine; callbacks are
+posted through the Flask test client with that engine in place of the app's.
+
+Results are written as JSON. Passing an earlier result file with --compare
+prints the change of every timing and exits with 1 when one of them got
+slower than --threshold allows.
+
+Run from the repository root, where the app finds its data:
+    python -m benchmarks.bench_suite [--scales 1 10 100] [--repeat 5]
+        [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import dash
+import folium
+import numpy as np
+import pandas as pd
+
+import callbacks
+from assets import topology
+from assets.model import BoroughRecommender, RecommenderEngine
+from benchmarks.bench_payloads import DEFAULT_VALUES, post
+from app import app
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "")
+ACM_TYPES = DEFAULT_VALUES["chk-acm-types.value"]
+RENT_RANGE = DEFAULT_VALUES["slider-rent.value"]
+RANKING = DEFAULT_VALUES["dpn-venue-types.value"]
+# Degrees between copies of London on the grid of scaled data
+GRID_STEP = (0.6, 1.0)
+
+
+def _copy_name(name, i):
+    return name if i == 0 else f"{name} #{i}"
+
+
+def _offsets(scale):
+    "Latitude and longitude offsets of every copy, the first one is not moved"
+    columns = math.ceil(math.sqrt(scale))
+    return [
+        ((i // columns) * GRID_STEP[0], (i % columns) * GRID_STEP[1])
+        for i in range(scale)
+    ]
+
+
+def _replicate(df, scale, shift=None, noise_columns=(), seed=0):
+    """
+    `scale` copies of `df` with renamed boroughs. `shift(df, dlat, dlon)` moves
+    the coordinates of a copy, `noise_columns` are varied by up to 10% in every
+    copy but the first so that the copies do not score the same.
+    """
+    rng = np.random.default_rng(seed)
+    copies = []
+    for i, (dlat, dlon) in enumerate(_offsets(scale)):
+        df_copy = df.copy()
+        df_copy["Borough"] = [_copy_name(b, i) for b in df["Borough"].astype(str)]
+        if shift is not None:
+            shift(df_copy, dlat, dlon)
+        if i > 0:
+            for column in noise_columns:
+                df_copy[column] = df_copy[column] * rng.uniform(0.9, 1.1, len(df_copy))
+        copies.append(df_copy)
+
+    df_scaled = pd.concat(copies, ignore_index=True)
+    df_scaled["Borough"] = pd.Categorical(df_scaled["Borough"])
+    return df_scaled
+
+
+def _shift_venues(df, dlat, dlon):
+    for column in ["Venue Latitude", "BoroughLat"]:
+        df[column] = df[column] + dlat
+    for column in ["Venue Longitude", "BoroughLon"]:
+        df[column] = df[column] + dlon
+
+
+def _shift_coordinates(coordinates, dlat, dlon):
+    if isinstance(coordinates[0], (int, float)):
+        return [coordinates[0] + dlon, coordinates[1] + dlat]
+    return [_shift_coordinates(c, dlat, dlon) for c in coordinates]
+
+
+def write_scaled_data(engine, scale, data_dir):
+    """
+    Writes data for `scale` times the boroughs and venues of `engine` to `data_dir`
+
+    Output:
+        data_dir with a trailing separator, for `RecommenderEngine`
+    """
+    df_rent = _replicate(engine.df_rent, scale)
+    df_rent.to_pickle(os.path.join(data_dir, RecommenderEngine.RENT_PICKLE))
+
+    df_venues = _replicate(engine.df_venues, scale, shift=_shift_venues)
+    df_venues.to_pickle(os.path.join(data_dir, RecommenderEngine.VENUES_PICKLE))
+
+    df_groups = _replicate(
+        engine.df_groups.reset_index(), scale, noise_columns=engine.venue_groups, seed=1
+    )
+    df_groups.to_pickle(os.path.join(data_dir, RecommenderEngine.GROUPS_PICKLE))
+
+    with open(engine.ldn_geojson) as handle:
+        features = json.load(handle)["features"]
+    scaled = []
+    for i, (dlat, dlon) in enumerate(_offsets(scale)):
+        for feature in features:
+            geometry = feature["geometry"]
+            scaled.append(
+                {
+                    "type": "Feature",
+                    "properties": {"name": _copy_name(feature["properties"]["name"], i)},
+                    "geometry": {
+                        "type": geometry["type"],
+                        "coordinates": _shift_coordinates(geometry["coordinates"], dlat, dlon),
+                    },
+                }
+            )
+    geojson_file = os.path.join(data_dir, RecommenderEngine.LDN_GEOJSON)
+    with open(geojson_file, "w") as handle:
+        json.dump({"type": "FeatureCollection", "features": scaled}, handle)
+    topology.write_levels(geojson_file, os.path.join(data_dir, RecommenderEngine.LOD_DIR))
+
+    return os.path.join(data_dir, "")
+
+
+def timeit(func, repeat, setup=None):
+    """
+    Runs `func` `repeat` times, `setup` before every run and outside of the timing
+
+    Output:
+        timings - dictionary of "min", "median", "mean" and "max" milliseconds
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        "min": min(seconds) * 1e3,
+        "median": statistics.median(seconds) * 1e3,
+        "mean": statistics.fmean(seconds) * 1e3,
+        "max": max(seconds) * 1e3,
+    }
+
+
+def micro_benchmarks(engine):
+    "Steps of `BoroughRecommender`, each run on a recommender prepared up to that step"
+    brec = BoroughRecommender(engine=engine, auto_update=False, auto_plot=False)
+    brec.accommodation_types = ACM_TYPES
+    brec.rent_range = RENT_RANGE
+    brec.set_preferences(RANKING)
+    brec._filter_rent_data()
+    brec.recommend()
+    brec._plot_boroughs()
+    df_matched = engine.plot_boroughs(brec.map, brec.recommended_boroughs, RANKING)
+    name = brec.recommended_boroughs[0]
+
+    return [
+        ("_filter_rent_data", brec._filter_rent_data),
+        ("recommend", brec.recommend),
+        ("_plot_boroughs", brec._plot_boroughs),
+        ("_plot_borough_venues", lambda: brec._plot_borough_venues(df_matched)),
+        (
+            "_plot_borough_venues markers",
+            lambda: brec._plot_borough_venues(df_matched, mode="markers"),
+        ),
+        ("highlight_borough_on_map", lambda: brec.highlight_borough_on_map(name)),
+        ("render map", brec.get_map_html),
+    ]
+
+
+def callback_benchmarks(client):
+    "The recommend callback, both branches of the map callback and the row click callbacks"
+
+    def call(output, values, changed):
+        response, _ = post(client, output, values, changed)
+        assert response.status_code == 200, response.status_code
+        return json.loads(response.data)["response"]
+
+    def recommend(values):
+        return call("dt-results.data", values, ["btn-recommend.n_clicks"])
+
+    values = dict(DEFAULT_VALUES)
+    result = recommend(values)
+    values.update(
+        {
+            "dt-results.data": result["dt-results"]["data"],
+            "store-query.data": result["store-query"]["data"],
+            "store-client.data": result["store-client"]["data"],
+        }
+    )
+    with_venues = {**values, "chk-display-venues.value": ["Y"]}
+    with_venues["store-query.data"] = recommend(with_venues)["store-query"]["data"]
+
+    def render_map(values):
+        call("map-frame.srcDoc", values, ["store-query.data"])
+
+    row_click = {
+        **values,
+        "dt-results.active_cell": {"row": 0, "column": 0, "column_id": "borough"},
+        "dt-venues.page_current": 0,
+        "dt-venues.page_size": 20,
+        "dt-venues.filter_query": "",
+    }
+
+    def details(output):
+        response, _ = post(client, output, row_click, ["dt-results.active_cell"])
+        assert response.status_code == 200, response.status_code
+
+    return [
+        ("run_recommender", lambda: recommend(values)),
+        ("render_results_map", lambda: render_map(values)),
+        ("render_results_map with venues", lambda: render_map(with_venues)),
+        ("show_borough_details", lambda: details("dt-rents.data")),
+        ("update_venue_page", lambda: details("dt-venues.data")),
+    ]
+
+
+@contextlib.contextmanager
+def serving(engine):
+    "Serves the callbacks from `engine` instead of the app's engine"
+    app_engine = callbacks.engine
+    callbacks.engine = engine
+    try:
+        yield
+    finally:
+        callbacks.engine = app_engine
+
+
+def run_scale(engine, scale, repeat):
+    def clear_caches():
+        engine.result_cache.clear()
+        engine.map_cache.clear()
+
+    size = {"boroughs": len(engine.borough_names), "venues": len(engine.df_venues)}
+    results = []
+    for name, func in micro_benchmarks(engine):
+        results.append({"scale": scale, "name": name, **size, **timeit(func, repeat)})
+
+    client = app.server.test_client()
+    with serving(engine):
+        for name, func in callback_benchmarks(client):
+            # Cold runs compute the recommendation and map, warm runs hit the caches
+            for cache, setup in [("cold", clear_caches), ("warm", None)]:
+                results.append(
+                    {
+                        "scale": scale,
+                        "name": f"callback {name} ({cache})",
+                        **size,
+                        **timeit(func, repeat, setup=setup),
+                    }
+                )
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": {
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "folium": folium.__version__,
+            "dash": dash.__version__,
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the median timings of `results` against those of `baseline`
+
+    Output:
+        regressions - number of timings more than `threshold` times slower
+    """
+    previous = {(r["scale"], r["name"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\n{'scale':>5} {'benchmark':<44} {'before':>10} {'after':>10} {'change':>8}")
+    for result in results:
+        before = previous.get((result["scale"], result["name"]))
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  slower"
+            regressions += 1
+        print(
+            f"{result['scale']:>5} {result['name']:<44} {before['median']:>9.2f}ms "
+            f"{result['median']:>9.2f}ms {ratio:>7.2f}x{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="median ratio reported as slower"
+    )
+    args = parser.parse_args()
+
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+    results = []
+    print(f"{'scale':>5} {'benchmark':<44} {'min':>10} {'median':>10}")
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as data_dir:
+            if scale == 1:
+                scaled_engine = engine
+            else:
+                scaled_engine = RecommenderEngine(
+                    data_dir=write_scaled_data(engine, scale, data_dir)
+                )
+            for result in run_scale(scaled_engine, scale, args.repeat):
+                print(
+                    f"{scale:>5} {result['name']:<44} {result['min']:>9.2f}ms "
+                    f"{result['median']:>9.2f}ms"
+                )
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(
+                {
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "environment": environment(),
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                handle,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
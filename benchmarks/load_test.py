@@ -0,0 +1,285 @@
+"""
+Load test of the results section: concurrent users posting the callback
+requests of the browser to a running server.
+
+Every user repeatedly asks for a recommendation with a random rent range,
+accommodation types, ranking and number of boroughs, waits for its map, and
+clicks a random borough of the results, which loads its rents and first
+venue page. Answers are checked against the engine loaded by this process,
+an answer for a different query than the one posted counts as corrupt.
+
+Without --url gunicorn is started with gunicorn.conf.py and stopped at the
+end. The load generator shares the machine with the server, so measure
+with fewer concurrent users than cores left to it.
+
+Run from the repository root, where the app finds its data:
+    python -m benchmarks.load_test [--concurrency 1 4 16] [--duration 30]
+        [--workers 4] [--url http://127.0.0.1:8050] [--output results.json]
+"""
+import argparse
+import html
+import json
+import random
+import threading
+import time
+import urllib.error
+import uuid
+
+import numpy as np
+
+from app import engine
+from assets.model import RecommendationQuery
+from benchmarks.bench_payloads import DEFAULT_VALUES, post
+from benchmarks.measure_memory import HttpClient, start_gunicorn, stop
+from layouts import MAX_RECS, RENT_MAX, RENT_MIN, STEP, acm_types
+
+PAGE_SIZE = 20
+INTERACTIONS = ["recommend", "map", "row click, details", "row click, venues"]
+
+
+def random_values(rng):
+    "Inputs of the recommend callback as a user could set them"
+    r_min, r_max = sorted(rng.sample(range(RENT_MIN, RENT_MAX + STEP, STEP), 2))
+    groups = engine.venue_groups
+    return {
+        **DEFAULT_VALUES,
+        "chk-acm-types.value": rng.sample(acm_types, rng.randint(1, len(acm_types))),
+        "slider-rent.value": [r_min, r_max],
+        "dpn-venue-types.value": rng.sample(groups, rng.randint(1, len(groups))),
+        "dpn-number-of-recs.value": rng.randint(1, MAX_RECS),
+        "chk-display-venues.value": ["Y"] if rng.random() < 0.25 else [],
+    }
+
+
+def query_of(values):
+    return RecommendationQuery(
+        rent_range=values["slider-rent.value"],
+        accommodation_types=values["chk-acm-types.value"],
+        ranking=values["dpn-venue-types.value"],
+        num_of_recs=values["dpn-number-of-recs.value"],
+        plot_venues=bool(values["chk-display-venues.value"]),
+    )
+
+
+def expected_boroughs(values):
+    return list(engine.recommend(query_of(values)).recommended_boroughs)
+
+
+def check_recommendation(values, result):
+    "True if `result` of the recommend callback answers the query of `values`"
+    boroughs = [row["borough"] for row in result["dt-results"]["data"]]
+    return (
+        boroughs == expected_boroughs(values)
+        and result["store-query"]["data"] == query_of(values).to_dict()
+    )
+
+
+def check_map(values, result):
+    "True if the map of `result` labels the boroughs recommended for `values`"
+    map_html = result["map-frame"]["srcDoc"]
+    return all(html.escape(b) in map_html for b in expected_boroughs(values))
+
+
+def check_rents(query, borough, result):
+    df_rent = engine.df_rent
+    expected = (df_rent["Borough"] == borough) & df_rent["Category"].isin(
+        query.accommodation_types
+    )
+    return len(result["dt-rents"]["data"]) == int(expected.sum())
+
+
+def check_venues(query, borough, result):
+    table = engine.venue_table
+    records, page_count = table.page(
+        table.rows(borough, list(query.ranking) or engine.venue_groups), 0, PAGE_SIZE
+    )
+    return (
+        result["dt-venues"]["data"] == records
+        and result["dt-venues"]["page_count"] == page_count
+    )
+
+
+def session(client, rng, verify, client_id=None):
+    """
+    Posts one recommendation, the request for its map and a click on one of
+    its boroughs. `client_id` identifies the user to the map renderer.
+
+    Output:
+        outcomes - list of (interaction, seconds, outcome), outcome is "ok",
+                   "error" or "corrupt"
+    """
+    outcomes = []
+
+    def call(name, output, values, changed, check):
+        try:
+            response, seconds = post(client, output, values, changed)
+        except (urllib.error.URLError, ConnectionError):
+            outcomes.append((name, float("nan"), "error"))
+            return None
+        if response.status_code != 200:
+            outcomes.append((name, seconds, "error"))
+            return None
+        result = json.loads(response.data)["response"]
+        ok = not verify or check(result)
+        outcomes.append((name, seconds, "ok" if ok else "corrupt"))
+        return result
+
+    values = {**random_values(rng), "store-client.data": client_id}
+    result = call(
+        "recommend",
+        "dt-results.data",
+        values,
+        ["btn-recommend.n_clicks"],
+        lambda result: check_recommendation(values, result),
+    )
+    if not result:
+        return outcomes
+
+    values["store-query.data"] = result["store-query"]["data"]
+    values["store-client.data"] = result["store-client"]["data"]
+    call(
+        "map",
+        "map-frame.srcDoc",
+        values,
+        ["store-query.data"],
+        lambda result: check_map(values, result),
+    )
+    if not result["dt-results"]["data"]:
+        return outcomes
+
+    rows = result["dt-results"]["data"]
+    row = rng.randrange(len(rows))
+    borough = rows[row]["borough"]
+    query = query_of(values)
+    values = {
+        **values,
+        "dt-results.data": rows,
+        "dt-results.active_cell": {"row": row, "column": 0, "column_id": "borough"},
+        "dt-venues.page_current": 0,
+        "dt-venues.page_size": PAGE_SIZE,
+        "dt-venues.filter_query": "",
+    }
+    call(
+        "row click, details",
+        "dt-rents.data",
+        values,
+        ["dt-results.active_cell"],
+        lambda result: check_rents(query, borough, result),
+    )
+    call(
+        "row click, venues",
+        "dt-venues.data",
+        values,
+        ["dt-results.active_cell"],
+        lambda result: check_venues(query, borough, result),
+    )
+    return outcomes
+
+
+def run(base_url, concurrency, duration, seed=0, verify=True):
+    "Runs `concurrency` users for `duration` seconds, returns their outcomes"
+    deadline = time.perf_counter() + duration
+    outcomes = []
+    lock = threading.Lock()
+
+    def user(i):
+        client = HttpClient(base_url)
+        rng = random.Random(seed * 1000 + i)
+        client_id = uuid.UUID(int=rng.getrandbits(128)).hex
+        done = []
+        while time.perf_counter() < deadline:
+            done.extend(session(client, rng, verify, client_id))
+        with lock:
+            outcomes.extend(done)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes, time.perf_counter() - start
+
+
+def summarize(outcomes, elapsed):
+    "Throughput, latency percentiles and error and corruption rates by interaction"
+    summary = {}
+    for name in INTERACTIONS + ["all"]:
+        selected = [o for o in outcomes if name == "all" or o[0] == name]
+        if not selected:
+            continue
+        seconds = np.array([s for _, s, outcome in selected if outcome != "error"])
+        p50, p90, p99 = (
+            np.percentile(seconds, [50, 90, 99]) * 1e3 if len(seconds) else [np.nan] * 3
+        )
+        summary[name] = {
+            "requests": len(selected),
+            "throughput": len(selected) / elapsed,
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": float(seconds.max() * 1e3) if len(seconds) else float("nan"),
+            "error_rate": sum(o[2] == "error" for o in selected) / len(selected),
+            "corrupt_rate": sum(o[2] == "corrupt" for o in selected) / len(selected),
+        }
+    return summary
+
+
+def report(concurrency, summary):
+    print(f"\n{concurrency} concurrent users")
+    print(
+        f"{'interaction':<20} {'requests':>8} {'req/s':>8} {'p50':>8} {'p90':>8} "
+        f"{'p99':>8} {'max':>8} {'errors':>7} {'corrupt':>7}"
+    )
+    for name, s in summary.items():
+        print(
+            f"{name:<20} {s['requests']:>8} {s['throughput']:>8.1f} {s['p50']:>6.1f}ms "
+            f"{s['p90']:>6.1f}ms {s['p99']:>6.1f}ms {s['max']:>6.1f}ms "
+            f"{s['error_rate']:>6.1%} {s['corrupt_rate']:>6.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--url", help="server to test, started locally if omitted")
+    parser.add_argument("--workers", type=int, default=4, help="workers of the local server")
+    parser.add_argument("--bind", default="127.0.0.1:8060", help="address of the local server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-verify", action="store_true", help="skip checking the answers")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process = start_gunicorn(args.workers, True, args.bind)
+        base_url = f"http://{args.bind}"
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            outcomes, elapsed = run(
+                base_url, concurrency, args.duration, args.seed, not args.no_verify
+            )
+            summary = summarize(outcomes, elapsed)
+            report(concurrency, summary)
+            results.append({"concurrency": concurrency, "seconds": elapsed, "summary": summary})
+    finally:
+        if process is not None:
+            stop(process)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(
+                {"url": base_url, "workers": None if args.url else args.workers, "results": results},
+                handle,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
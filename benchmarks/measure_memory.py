@@ -0,0 +1,163 @@
+"""
+Shared and private memory of gunicorn workers, read from /proc (Linux only).
+
+Starts gunicorn with gunicorn.conf.py, runs the interactions of
+`bench_payloads` against it so that the workers touch the data, and reports
+the memory of the master and of every worker. With --compare it does so with
+and without preloading the app.
+
+Run from the repository root, where the app finds its data:
+    python -m benchmarks.measure_memory [--workers 4] [--compare]
+    python -m benchmarks.measure_memory --pid <gunicorn master pid>
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py")
+FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"]
+
+
+def read_memory(pid):
+    "Memory totals of process `pid` in MB"
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as handle:
+        for line in handle:
+            parts = line.split()
+            if parts[0].rstrip(":") in FIELDS:
+                memory[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    memory["Shared"] = memory["Shared_Clean"] + memory["Shared_Dirty"]
+    memory["Private"] = memory["Private_Clean"] + memory["Private_Dirty"]
+    return memory
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as handle:
+        return [int(child) for child in handle.read().split()]
+
+
+def report(master_pid):
+    "Prints the memory of the master and its workers, returns the worker totals"
+    print(f"{'process':>14} {'rss':>8} {'pss':>8} {'shared':>8} {'private':>8}   (MB)")
+    rows = [("master", master_pid)] + [("worker", pid) for pid in children(master_pid)]
+    totals = {"Pss": 0.0, "Private": 0.0}
+    for name, pid in rows:
+        memory = read_memory(pid)
+        print(
+            f"{name:>7} {pid:>6} {memory['Rss']:8.1f} {memory['Pss']:8.1f} "
+            f"{memory['Shared']:8.1f} {memory['Private']:8.1f}"
+        )
+        totals["Pss"] += memory["Pss"]
+        if name == "worker":
+            totals["Private"] += memory["Private"]
+    print(f"{'total':>14} {'':>8} {totals['Pss']:8.1f} {'':>8} {totals['Private']:8.1f}")
+    return totals
+
+
+class HttpClient(object):
+    "Posts JSON like the Flask test client, for `bench_payloads.interactions`"
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def post(self, path, json=None):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=_dumps(json),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            response.status_code = response.status
+            response.data = response.read()
+            return response
+
+
+def _dumps(value):
+    return json.dumps(value).encode("utf-8")
+
+
+def wait_until_ready(process, base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(base_url + "/_dash-layout").read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise RuntimeError(f"gunicorn did not answer on {base_url} within {timeout}s")
+
+
+def start_gunicorn(workers, preload, bind):
+    "Starts gunicorn with gunicorn.conf.py, returns the process once it answers"
+    env = {
+        **os.environ,
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_PRELOAD": "1" if preload else "0",
+        "GUNICORN_BIND": bind,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", CONFIG], env=env
+    )
+    try:
+        wait_until_ready(process, f"http://{bind}")
+    except BaseException:
+        stop(process)
+        raise
+    return process
+
+
+def stop(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait()
+
+
+def measure(workers, preload, bind, requests):
+    process = start_gunicorn(workers, preload, bind)
+    try:
+        base_url = f"http://{bind}"
+
+        from benchmarks.bench_payloads import DEFAULT_VALUES, interactions
+
+        client = HttpClient(base_url)
+        for _ in range(requests):
+            for _ in interactions(client, DEFAULT_VALUES):
+                pass
+
+        print(f"\npreload_app={preload}, {workers} workers, {requests} rounds of requests")
+        return report(process.pid)
+    finally:
+        stop(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pid", type=int, help="measure a running gunicorn master")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--bind", default="127.0.0.1:8060")
+    parser.add_argument("--requests", type=int, default=20, help="rounds of interactions")
+    parser.add_argument("--compare", action="store_true", help="also measure without preload")
+    args = parser.parse_args()
+
+    if args.pid:
+        report(args.pid)
+        return
+
+    preloaded = measure(args.workers, True, args.bind, args.requests)
+    if args.compare:
+        separate = measure(args.workers, False, args.bind, args.requests)
+        print(
+            f"\nPSS total {separate['Pss']:.1f} MB -> {preloaded['Pss']:.1f} MB, "
+            f"worker private {separate['Private']:.1f} MB -> {preloaded['Private']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,294 +1,242 @@
-from dash.dependencies import Input, Output, State
-from app import app
-import folium
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from app import app, engine
 
 from dash.exceptions import PreventUpdate
+from flask import abort, jsonify, request
 
-import numpy as np
 import pandas as pd
-import dash_core_components as dcc
-import dash_html_components as html
-import dash_table as dt
 import dash
-from dash_table.Format import Format, Scheme, Sign, Symbol
-from assets.model import BoroughRecommender
+import dash_core_components as dcc
+import uuid
+from assets.model import RecommendationQuery
+from assets.renderer import MapRenderer, RenderCancelled
+
+# Hashed map scripts and borough outlines, cached by browsers
+engine.static_files.register(app.server)
+# Stage timings on /metrics, only when enabled in app.py
+engine.metrics.register(app.server)
+# Maps are rendered after the results table is sent, a new click cancels the previous render
+map_renderer = MapRenderer(max_workers=2)
+
+
+@app.server.route(engine.VENUES_URL)
+def map_venues():
+    "Venue clusters inside the viewport of a results map, for zoom levels it does not embed"
+    try:
+        zoom = int(request.args["zoom"])
+        west, south, east, north = [float(v) for v in request.args["bbox"].split(",")]
+    except (KeyError, ValueError):
+        abort(400)
+
+    with engine.metrics.stage("venue_clusters"):
+        level = engine.venue_clusters_in_view(
+            [[south, west], [north, east]],
+            zoom,
+            request.args.getlist("borough"),
+            request.args.getlist("group"),
+        )
+    return jsonify(level)
 
-brec = BoroughRecommender(
-    data_dir="data\\", num_of_recs=5, auto_update=True, plot_venues=False
-)
 
 @app.callback(
     [
-        Output("results", "children"),
-        Output("results-map", "children"),
+        Output("dt-results", "data"),
+        Output("dt-results", "active_cell"),
+        Output("dt-results", "selected_cells"),
         Output("section-results", "hidden"),
-        Output("results-rent", "children"),
-        Output("results-venues", "children"),
         Output("footer", "hidden"),
+        Output("store-query", "data"),
+        Output("store-client", "data"),
     ],
-    [
-        Input("btn-recommend", "n_clicks"),
-        Input('dt-results', 'active_cell'),
-    ],
+    [Input("btn-recommend", "n_clicks")],
     [
         State("chk-acm-types", "value"),
         State("slider-rent", "value"),
         State("dpn-venue-types", "value"),
         State("dpn-number-of-recs", "value"),
         State("chk-display-venues", "value"),
-        State('dt-results', 'data'),
+        State("store-client", "data"),
     ],
     prevent_initial_call=True,
 )
-def run_recommender(rec_click, active_cell, acm_types, rent_range, venue_rank, n_recs, plot_venues, dt_data):
-    
-    ctx = dash.callback_context
-    
-    if not ctx.triggered:
+def run_recommender(rec_click, acm_types, rent_range, venue_rank, n_recs, plot_venues, client):
+    if not rec_click:
         raise PreventUpdate
+    if not plot_venues:
+        plot_venues = False
     else:
-        trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
-
-    if trigger_id == 'btn-recommend':
-        if not rec_click:
-            raise PreventUpdate
-        if not plot_venues:
-            plot_venues = False
-        else:
-            plot_venues = True
-
-        brec.plot_venues = plot_venues
-        brec.num_of_recs = n_recs 
-        brec.set_rent_range(rent_range)
-        brec.set_accommodation_types(acm_types)
-        brec.set_preferences(venue_rank)
-        brec.recommend()
-        brec.save_map("map.html")
-
-        out_map = html.Iframe(
-            srcDoc=open("map.html", "r", encoding="utf8").read(),
-            width="100%",
-            height=600,
+        plot_venues = True
+
+    query = RecommendationQuery(
+        rent_range=rent_range,
+        accommodation_types=acm_types,
+        ranking=venue_rank,
+        num_of_recs=n_recs,
+        plot_venues=plot_venues,
+    )
+    with engine.metrics.stage("recommend"):
+        result = engine.recommend(query)
+
+    # Match scores of the top boroughs as percentages of their total
+    with engine.metrics.stage("results_table"):
+        match = result.match
+        df_rec_n = pd.DataFrame(
+            {"borough": result.recommended_boroughs, "match": 100 * match / match.sum()}
         )
+        rec_data = df_rec_n.to_dict(orient="records")
 
-        df_rec = brec.df_recommendation.copy()
-        n_recs = brec.num_of_recs
+    # Clearing the active cell hides the details of the previous results,
+    # the map follows from `render_results_map`
+    return [
+        rec_data,
+        None,
+        [],
+        False,
+        False,
+        query.to_dict(),
+        client or uuid.uuid4().hex,
+    ]
 
-        df_rec.loc[:, "Match"] = df_rec["Match"] * 100
 
-        df_rec_n = df_rec.iloc[:n_recs].copy()
+@app.callback(
+    Output("map-frame", "srcDoc"),
+    [Input("store-query", "data")],
+    [State("store-client", "data")],
+    prevent_initial_call=True,
+)
+def render_results_map(query_data, client):
+    if not query_data:
+        raise PreventUpdate
 
-        df_rec_n.loc[:, "Match"] = 100 * df_rec_n["Match"] / df_rec_n["Match"].sum()
-        df_rec_n.reset_index(inplace=True)
-        df_rec_n.columns = ["borough", "match"]
-        rec_data = df_rec_n.to_dict(orient="records")
+    # The result is cached by `run_recommender`
+    result = engine.recommend(RecommendationQuery.from_dict(query_data))
+    try:
+        with engine.metrics.stage("map_html"):
+            return map_renderer.render(
+                client,
+                lambda cancelled: engine.render_map_html(result, cancelled=cancelled),
+            )
+    except RenderCancelled:
+        # Superseded by a newer click, the browser no longer waits for this map
+        raise PreventUpdate
 
-        # Create Data table
-        rec_table_cols = [
-            {
-                "name": "Borough",
-                "id": "borough",
-                "type": "text",
-            },
-            {
-                "name": "Match Score",
-                "id": "match",
-                "type": "numeric",
-                "format": Format(precision=3),
-            },
-        ]
-
-        rec_style_cell_conditional = [
-            {"if": {"column_id": "borough"}, "textAlign": "left"}
-        ]
-
-        rec_table = dt.DataTable(
-            id="dt-results",
-            data=rec_data,
-            columns=rec_table_cols,
-            style_cell_conditional=rec_style_cell_conditional,
-            style_header={
-                'backgroundColor': 'rgb(230, 230, 230)',
-                'fontWeight': 'bold',
-                'textAlign': 'left',
-            },
-            style_data_conditional=[
-                {
-                    'if': {'row_index': 'odd'},
-                    'backgroundColor': 'rgb(248, 248, 248)'
-                }
-            ],
-        )
 
-        available_boroughs = brec.recommended_boroughs
-        
-        borough_opts = []
-        for b in available_boroughs:
-            borough_opts.append(
-                {'label': b, 'value': b}
-            )
-        
-        return [rec_table, out_map, False, None, None, False]
-    else:
-        row_idx = active_cell['row']
-        column_id = active_cell['column_id']
-        if column_id == 'borough':
-            selected_borough = dt_data[row_idx]['borough']
-            brec.highlight_borough_on_map(name=selected_borough)
-            brec.save_map("map.html")
-
-            out_map = html.Iframe(
-                srcDoc=open("map.html", "r", encoding="utf8").read(),
-                width="100%",
-                height=600,
-            )
+def selected_borough(active_cell, dt_data):
+    "Borough of the clicked cell of `dt-results`, None unless a borough was clicked"
+    if not active_cell or active_cell['column_id'] != 'borough':
+        return None
+    return dt_data[active_cell['row']]['borough']
 
-            df_rent =  brec.df_rent
-            accom = brec.accommodation_types
-
-            select_cond = (df_rent['Borough']==selected_borough) & (df_rent['Category'].isin(accom))
-            df_rent = df_rent.loc[select_cond]
-            rent_cols = df_rent.columns
-            keep_cols = rent_cols[1:]
-            df_rent = df_rent[keep_cols]
-
-            rent_data = df_rent.to_dict(orient='records')
-            rent_columns = [{"name": i, "id": i} for i in df_rent.columns]
-            
-            for i in range(1,4):
-                rent_columns[i]['type'] = "numeric"
-                rent_columns[i]['format'] = Format(group=',')
-                rent_columns[i]['name'] += ' (£)'
-
-            dt_rent = dt.DataTable(
-                id="dt-rents",
-                data=rent_data,
-                columns=rent_columns,
-                style_data_conditional=[
-                    {
-                        'if': {'row_index': 'odd'},
-                        'backgroundColor': 'rgb(248, 248, 248)'
-                    }
-                ],
-                style_header={
-                    'backgroundColor': 'rgb(230, 230, 230)',
-                    'fontWeight': 'bold',
-                    'textAlign': 'left',
-                },
-                style_cell_conditional=[
-                    {'if': {'column_id': 'Category'},
-                    'minWidth': '180px', 'width': '180px', 'maxWidth': '180px', 'textAlign': 'left'},
-                    {'if': {'column_id': 'Lower quartile'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
-                    {'if': {'column_id': 'Median'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
-                    {'if': {'column_id': 'Upper quartile'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
-                ]
-            )
 
-            venue_groups = brec.selected_groups
-
-            df_venues = brec.df_venues
-            select_cond = (df_venues['Borough']==selected_borough) & (df_venues['Group'].isin(venue_groups))
-            df_venues = df_venues.loc[select_cond]
-
-            # venue sorting
-            sort_ord = {}
-            for i, v in enumerate(venue_groups):
-                sort_ord[v] = i
-
-            df_venues.loc[:, 'sort'] = df_venues['Group'].map(sort_ord)
-            df_venues.sort_values(by='sort', inplace=True)
-            del df_venues['sort']
-            
-            url_gm = "https://www.google.com/maps/search/?api=1&query=" #<lat>,<lng>
-            url_gm = "https://www.google.com/maps/search/?api=1&query={0},{1}"
-            df_venues.loc[:, 'gmaps_url'] = df_venues.apply(lambda x: url_gm.format(x['Venue Latitude'], x['Venue Longitude']), axis=1)
-            col_format = "[Link to Maps]({0})"
-            df_venues.loc[:, 'URL'] = df_venues['gmaps_url'].apply(lambda x: col_format.format(x))
-            
-    
-            col_order =  ['Venue', 'Group', 'Venue Category', 'URL']
-            df_venues = df_venues[col_order]
-
-            venue_data = df_venues.to_dict(orient='records')
-            venue_columns = [{"name": i, "id": i} for i in df_venues.columns]
-            venue_columns[-1] = {"name": "URL", "id": "URL", "type": 'text', "presentation": "markdown"}
-            available_boroughs = brec.recommended_boroughs
-
-            dt_venues = dt.DataTable(
-                id="dt-venues",
-                data=venue_data,
-                columns=venue_columns,
-                page_current=0,
-                page_size=20,
-                filter_action='native',
-                style_data_conditional=[
-                    {
-                        'if': {'row_index': 'odd'},
-                        'backgroundColor': 'rgb(248, 248, 248)'
-                    }
-                ],
-                style_header={
-                    'backgroundColor': 'rgb(230, 230, 230)',
-                    'fontWeight': 'bold',
-                    'textAlign': 'left',
-                },
-                style_cell_conditional=[
-                    {'if': {'column_id': 'Venue'},
-                    'minWidth': '180px', 'width': '180px', 'maxWidth': '180px', 'textAlign': 'left'},
-                    {'if': {'column_id': 'Group'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'left'},
-                    {'if': {'column_id': 'Venue Category'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'left'},
-                    {'if': {'column_id': 'URL'},
-                    'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'center'},
-                ],
-                export_format='csv',
-                export_headers="display",
-            )
-            rec_table_cols = [
-                {
-                    "name": "Borough",
-                    "id": "borough",
-                    "type": "text",
-                },
-                {
-                    "name": "Match Score",
-                    "id": "match",
-                    "type": "numeric",
-                    "format": Format(precision=3),
-                },
-            ]
-
-            rec_style_cell_conditional = [
-                {"if": {"column_id": "borough"}, "textAlign": "left"}
-            ]
-
-            rec_table = dt.DataTable(
-                id="dt-results",
-                data=dt_data,
-                columns=rec_table_cols,
-                style_cell_conditional=rec_style_cell_conditional,
-                style_header={
-                    'backgroundColor': 'rgb(230, 230, 230)',
-                    'fontWeight': 'bold',
-                    'textAlign': 'left',
-                },
-                style_data_conditional=[
-                    {
-                        'if': {'row_index': 'odd'},
-                        'backgroundColor': 'rgb(248, 248, 248)'
-                    }
-                ],
-            )
+@app.callback(
+    [
+        Output("dt-rents", "data"),
+        Output("dt-venues", "page_current"),
+        Output("dt-venues", "filter_query"),
+        Output("results-details", "hidden"),
+    ],
+    [Input("dt-results", "active_cell")],
+    [
+        State("dt-results", "data"),
+        State("store-query", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def show_borough_details(active_cell, dt_data, query_data):
+    if not active_cell:
+        return [dash.no_update, dash.no_update, dash.no_update, True]
 
+    borough = selected_borough(active_cell, dt_data)
+    if borough is None:
+        raise PreventUpdate
 
+    # Selection comes from the query that produced `dt_data`
+    query = RecommendationQuery.from_dict(query_data)
+
+    with engine.metrics.stage("rents_table"):
+        df_rent =  engine.df_rent
+        accom = query.accommodation_types
+
+        select_cond = (df_rent['Borough']==borough) & (df_rent['Category'].isin(accom))
+        df_rent = df_rent.loc[select_cond]
+        rent_cols = df_rent.columns
+        keep_cols = rent_cols[1:]
+        df_rent = df_rent[keep_cols]
+
+        rent_data = df_rent.to_dict(orient='records')
+
+    # The venue table starts again from its first, unfiltered page
+    return [rent_data, 0, "", False]
+
+
+@app.callback(
+    [
+        Output("dt-venues", "data"),
+        Output("dt-venues", "page_count"),
+    ],
+    [
+        Input("dt-results", "active_cell"),
+        Input("dt-venues", "page_current"),
+        Input("dt-venues", "page_size"),
+        Input("dt-venues", "filter_query"),
+    ],
+    [
+        State("dt-results", "data"),
+        State("store-query", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def update_venue_page(active_cell, page_current, page_size, filter_query, dt_data, query_data):
+    borough = selected_borough(active_cell, dt_data)
+    if borough is None:
+        raise PreventUpdate
+
+    # Venues of the borough ordered by the rank of their group, links are made for one page only
+    table = engine.venue_table
+    with engine.metrics.stage("venue_page"):
+        rows = venue_rows(borough, query_data, filter_query)
+        return table.page(rows, page_current or 0, page_size)
+
+
+def venue_rows(borough, query_data, filter_query):
+    "Rows of `engine.venue_table` shown for `borough`, in every page of the table"
+    query = RecommendationQuery.from_dict(query_data)
+    venue_groups = list(query.ranking) or engine.venue_groups
+
+    table = engine.venue_table
+    return table.filter(table.rows(borough, venue_groups), filter_query)
+
+
+@app.callback(
+    Output("download-venues", "data"),
+    [Input("btn-export-venues", "n_clicks")],
+    [
+        State("dt-results", "active_cell"),
+        State("dt-venues", "filter_query"),
+        State("dt-results", "data"),
+        State("store-query", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def export_venues(n_clicks, active_cell, filter_query, dt_data, query_data):
+    borough = selected_borough(active_cell, dt_data)
+    if borough is None:
+        raise PreventUpdate
+
+    with engine.metrics.stage("venue_export"):
+        rows = venue_rows(borough, query_data, filter_query)
+        return dcc.send_string(engine.venue_table.to_csv(rows), f"{borough} venues.csv")
+
+
+# The borough outline is taken from the map itself, nothing is sent by the server
+app.clientside_callback(
+    ClientsideFunction(namespace="map", function_name="highlight_borough"),
+    Output("map-highlight", "children"),
+    [Input("dt-results", "active_cell")],
+    [State("dt-results", "data")],
+    prevent_initial_call=True,
+)
 
-            return [rec_table, out_map, False, dt_rent, dt_venues, False]
-        else:
-            raise PreventUpdate
 
 @app.callback(
     Output("btn-recommend", "disabled"),
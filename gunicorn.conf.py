@@ -0,0 +1,43 @@
+"""
+Gunicorn settings for serving the app with several workers.
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+
+The app, and with it the recommender data, is loaded once in the master
+process (`preload_app`). Workers are forked from it and share its memory
+copy-on-write. The garbage collector is kept from touching the loaded objects,
+as writing their headers would copy the pages into every worker:
+collection is disabled while the app loads, the loaded objects are moved to
+the permanent generation with `gc.freeze()` before forking, and collection
+is enabled again in the workers.
+
+Workers serve GUNICORN_THREADS requests at the same time on threads sharing
+the engine, so a tab's new map request can cancel its previous render (see
+assets/renderer.py) while the older request is still running.
+
+Set GUNICORN_PRELOAD=0 to load the app in every worker instead, e.g. to
+compare memory use with `python -m benchmarks.measure_memory`.
+"""
+import gc
+import os
+
+wsgi_app = "index:server"
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8050")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+if preload_app:
+    # no collections while the app is imported in the master
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
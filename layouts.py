@@ -9,10 +9,10 @@ import dash_html_components as html
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
+from dash_table.Format import Format
+from app import engine
 from assets.model import BoroughRecommender
 
-brec = BoroughRecommender(data_dir="data\\", num_of_recs=5)
-
 ABOUT = """
 The application below is part of Coursera's IBM Data Science Captstone project. The goal was to create a recommender that would help user to decide which London borough to look for accommodation in based on their preferences.
 
@@ -26,13 +26,89 @@ The algorithm takes three user inputs:
 More information on methodology can be found in the Methodology section and in GitHub repository.
 """
 
-acm_types = brec.ACM_TYPES
-categories = brec.venue_groups
+acm_types = BoroughRecommender.ACM_TYPES
+categories = engine.venue_groups
+
+# Result tables are created once, callbacks only update their data
+TABLE_HEADER_STYLE = {
+    "backgroundColor": "rgb(230, 230, 230)",
+    "fontWeight": "bold",
+    "textAlign": "left",
+}
+TABLE_ODD_ROW_STYLE = [
+    {"if": {"row_index": "odd"}, "backgroundColor": "rgb(248, 248, 248)"}
+]
+
+results_table = dt.DataTable(
+    id="dt-results",
+    data=[],
+    columns=[
+        {"name": "Borough", "id": "borough", "type": "text",},
+        {
+            "name": "Match Score",
+            "id": "match",
+            "type": "numeric",
+            "format": Format(precision=3),
+        },
+    ],
+    style_cell_conditional=[{"if": {"column_id": "borough"}, "textAlign": "left"}],
+    style_header=TABLE_HEADER_STYLE,
+    style_data_conditional=TABLE_ODD_ROW_STYLE,
+)
+
+rents_table = dt.DataTable(
+    id="dt-rents",
+    data=[],
+    columns=[{"name": "Category", "id": "Category"}]
+    + [
+        {"name": f"{c} (£)", "id": c, "type": "numeric", "format": Format(group=",")}
+        for c in ["Lower quartile", "Median", "Upper quartile"]
+    ],
+    style_data_conditional=TABLE_ODD_ROW_STYLE,
+    style_header=TABLE_HEADER_STYLE,
+    style_cell_conditional=[
+        {'if': {'column_id': 'Category'},
+        'minWidth': '180px', 'width': '180px', 'maxWidth': '180px', 'textAlign': 'left'},
+        {'if': {'column_id': 'Lower quartile'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
+        {'if': {'column_id': 'Median'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
+        {'if': {'column_id': 'Upper quartile'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'right'},
+    ],
+)
+
+venues_table = dt.DataTable(
+    id="dt-venues",
+    data=[],
+    columns=[
+        {"name": "Venue", "id": "Venue"},
+        {"name": "Group", "id": "Group"},
+        {"name": "Venue Category", "id": "Venue Category"},
+        {"name": "URL", "id": "URL", "type": "text", "presentation": "markdown"},
+    ],
+    # pages are filtered and served by the `update_venue_page` callback
+    page_current=0,
+    page_size=20,
+    page_action="custom",
+    filter_action="custom",
+    filter_query="",
+    style_data_conditional=TABLE_ODD_ROW_STYLE,
+    style_header=TABLE_HEADER_STYLE,
+    style_cell_conditional=[
+        {'if': {'column_id': 'Venue'},
+        'minWidth': '180px', 'width': '180px', 'maxWidth': '180px', 'textAlign': 'left'},
+        {'if': {'column_id': 'Group'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'left'},
+        {'if': {'column_id': 'Venue Category'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'left'},
+        {'if': {'column_id': 'URL'},
+        'minWidth': '90px', 'width': '90px', 'maxWidth': '90px', 'textAlign': 'center'},
+    ],
+)
 venue_opts = [{"label": c, "value": c} for c in categories]
 acm_options = [{"label": acm, "value": acm} for acm in acm_types]
 
-del brec
-
 RENT_MIN = 0
 RENT_MAX = 3200
 STEP = 200
@@ -236,6 +312,12 @@ base_layout = html.Div(
                             id="section-results",
                             children=[
                                 html.H3("Results"),
+                                # Query behind the currently displayed results
+                                dcc.Store(id="store-query"),
+                                # Identifies the browser tab to the map renderer, set by the first recommendation
+                                dcc.Store(id="store-client"),
+                                # Name of the borough outlined over the map by a client side callback
+                                html.Div(id="map-highlight", hidden=True),
                                 html.P(
                                     "For more information about the rent and venues in a specific borough, please click on the borough in the data table."
                                 ),
@@ -245,26 +327,47 @@ base_layout = html.Div(
                                         html.Div(
                                             id="results",
                                             className="col-4",
-                                            children=[dt.DataTable(id="dt-results",),],
+                                            children=[results_table],
                                         ),
                                         html.Div(
                                             id="results-map",
                                             className="col-8",
-                                            children=[],
+                                            children=[
+                                                # The map is rendered after the table is shown
+                                                dcc.Loading(
+                                                    html.Iframe(
+                                                        id="map-frame", width="100%", height=600
+                                                    ),
+                                                    type="circle",
+                                                )
+                                            ],
                                         ),
                                     ],
                                 ),
                                 html.Div(
+                                    id="results-details",
                                     className="content-segment",
+                                    hidden=True,
                                     children=[
                                         html.Div(
                                             id="results-rent",
-                                            children=[],
+                                            children=[rents_table],
                                             style={"margin-top": "25px",},
                                         ),
                                         html.Div(
                                             id="results-venues",
-                                            children=[],
+                                            children=[
+                                                # The table holds one page, all filtered venues are exported by the server
+                                                dbc.Button(
+                                                    "Export CSV",
+                                                    id="btn-export-venues",
+                                                    color="dark",
+                                                    size="sm",
+                                                    style={"margin-bottom": "10px"},
+                                                ),
+                                                dcc.Download(id="download-venues"),
+                                                venues_table,
+                                            ],
                                             style={
                                                 "margin-top": "25px",
                                                 "margin-bottom": "20px",
@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from assets import datastore
+
+
+def test_new_versions_leave_mapped_arrays_intact(tmp_path):
+    store = str(tmp_path / "store")
+    df = pd.DataFrame({"a": np.arange(100_000, dtype=np.float64), "b": ["x", "y"] * 50_000})
+    datastore.write_store({"t": df}, store)
+    mapped = datastore.read_table(store, "t")
+
+    # Shorter tables would truncate the mapped files if they were written in place
+    datastore.write_store({"t": df.iloc[:10]}, store)
+    datastore.write_store({"t": df.iloc[:5]}, store)
+
+    assert mapped["a"].sum() == df["a"].sum()
+    assert mapped["b"].tolist() == df["b"].tolist()
+    assert datastore.read_table(store, "t").equals(
+        df.iloc[:5].astype({"b": "category"})
+    )
+    assert {"manifest.json", "v2", "v3"} <= set(os.listdir(store))
+    assert datastore.read_manifest(store)["directory"] == "v3"
@@ -0,0 +1,96 @@
+import os
+import random
+
+import numpy as np
+
+from assets.model import BoroughRecommender, RecommendationQuery, RecommenderEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "")
+
+
+def test_base_layer_url_is_the_same_for_every_engine():
+    # Workers build their own engines and must serve the script under one URL
+    first = RecommenderEngine(data_dir=DATA_DIR)
+    second = RecommenderEngine(data_dir=DATA_DIR)
+    assert first.base_layer_url == second.base_layer_url
+    assert first.base_layer.to_script("f") == second.base_layer.to_script("f")
+
+
+def test_venue_clusters_cover_every_venue():
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+    df_venues = engine.df_venues
+    min_zoom, max_zoom = engine.CLUSTER_ZOOMS
+    bounds = [
+        [df_venues["Venue Latitude"].min(), df_venues["Venue Longitude"].min()],
+        [df_venues["Venue Latitude"].max(), df_venues["Venue Longitude"].max()],
+    ]
+    boroughs = df_venues["Borough"].astype(str).unique().tolist()
+
+    for max_bytes in [engine.CLUSTER_BYTES, 0]:
+        payload = engine.venue_clusters(df_venues, max_bytes=max_bytes)
+        assert (payload["min_zoom"], payload["max_zoom"]) == engine.CLUSTER_ZOOMS
+        assert 1 <= len(payload["levels"]) < max_zoom - min_zoom + 1
+        for level in payload["levels"]:
+            assert sum(level["points"][2::4]) == len(df_venues)
+    assert len(payload["levels"]) == 1
+
+    # Levels that are not embedded are fetched for the viewport, down to single venues
+    for zoom in range(min_zoom, max_zoom + 1):
+        level = engine.venue_clusters_in_view(bounds, zoom, boroughs, list(engine.VENUE_COLORS))
+        assert sum(level["points"][2::4]) == len(df_venues)
+    assert set(level["points"][2::4]) == {1}
+    assert sorted(level["names"]) == sorted(df_venues["Venue"].astype(str))
+
+
+def test_small_results_embed_every_venue_cluster_level():
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+    df_venues = engine.df_venues
+    df_venues = df_venues.loc[df_venues["Borough"] == engine.borough_names[0]]
+    payload = engine.venue_clusters(df_venues)
+    min_zoom, max_zoom = engine.CLUSTER_ZOOMS
+    assert len(payload["levels"]) == max_zoom - min_zoom + 1
+    assert len(payload["levels"][-1]["names"]) == len(df_venues)
+
+
+def test_highlight_after_update_plots_the_map_once():
+    brec = BoroughRecommender(engine=RecommenderEngine(data_dir=DATA_DIR))
+    plots = []
+    plot_boroughs = brec.engine.plot_boroughs
+    brec.engine.plot_boroughs = lambda *args: plots.append(1) or plot_boroughs(*args)
+
+    brec.update(rent_range=[400, 1200], ranking=["Shopping", "Eating out"])
+    brec.highlight_borough_on_map(brec.engine.borough_names[0])
+    assert len(plots) == 1
+
+    # without staged changes the map is plotted again to drop the old highlight
+    brec.highlight_borough_on_map(brec.engine.borough_names[1])
+    assert len(plots) == 2
+
+
+def test_recommend_many_matches_recommend():
+    engine = RecommenderEngine(data_dir=DATA_DIR)
+    rng = random.Random(0)
+    categories = engine.df_rent["Category"].unique().tolist()
+    queries = [RecommendationQuery(num_of_recs=n) for n in [1, 5, 40]]
+    for _ in range(200):
+        low, high = sorted(rng.sample(range(0, 3300, 100), 2))
+        queries.append(
+            RecommendationQuery(
+                rent_range=[low, high],
+                accommodation_types=rng.sample(categories, rng.randint(1, 3)),
+                # rankings with one group leave boroughs without venues of it tied at 0
+                ranking=rng.sample(engine.venue_groups, rng.randint(0, 2)),
+                num_of_recs=rng.randint(0, 40),
+            )
+        )
+
+    many = engine.recommend_many(queries, chunk_size=64)
+
+    for query, result in zip(queries, many):
+        expected = engine.recommend(query)
+        assert result.recommended_boroughs == expected.recommended_boroughs
+        assert result.selected_boroughs == expected.selected_boroughs
+        np.testing.assert_allclose(result.match, expected.match)
+    # every borough ties without a ranking, ties keep the order of `borough_names`
+    assert many[1].recommended_boroughs == tuple(engine.borough_names[:5])
+
@@ -0,0 +1,80 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from assets import datastore, pipeline
+from assets.model import RecommendationQuery, RecommenderEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+GROUPS = ["Eating out", "Shopping"]
+QUERY = RecommendationQuery(
+    rent_range=[1000, 2000],
+    accommodation_types=["One Bedroom"],
+    ranking=["Eating out", "Shopping"],
+    num_of_recs=5,
+)
+
+
+def venues(rows):
+    return pd.DataFrame(rows, columns=["Borough", "Group"])
+
+
+def test_update_group_counts_adds_new_boroughs():
+    df_counts = pipeline.count_groups(
+        [venues([("Camden", "Eating out"), ("Camden", "Shopping"), ("Brent", "Shopping")])],
+        ["Camden", "Brent"],
+        GROUPS,
+    )
+    df_venues = venues([("Camden", "Shopping"), ("Hackney", "Eating out"), ("Hackney", "Eating out")])
+
+    df = pipeline.update_group_counts(df_counts, df_venues, ["Camden", "Hackney"])
+
+    counts = df.set_index("Borough")[GROUPS]
+    assert counts.loc["Camden"].tolist() == [0, 1]
+    assert counts.loc["Brent"].tolist() == [0, 1]
+    assert counts.loc["Hackney"].tolist() == [2, 0]
+
+
+def test_rebuild_from_csv_chunks_matches_stored_groups(tmp_path):
+    tables = pipeline.load_tables(DATA_DIR, str(tmp_path / "missing"))
+    venues_file = str(tmp_path / "venues.csv")
+    tables["venues"].drop(columns=["Borough", "BoroughLat", "BoroughLon"]).to_csv(
+        venues_file, index=False
+    )
+
+    rebuilt = pipeline.rebuild(
+        venues_file, DATA_DIR, str(tmp_path / "store"), chunk_size=1000
+    )
+
+    expected = tables["groups"].astype({"Borough": str}).set_index("Borough")
+    actual = rebuilt["groups"].set_index("Borough").loc[expected.index, expected.columns]
+    np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), atol=1e-9)
+
+
+def test_rebuild_while_an_engine_maps_the_store(tmp_path):
+    data_dir = tmp_path / "data"
+    store_dir = str(data_dir / "store")
+    data_dir.mkdir()
+    shutil.copy(os.path.join(DATA_DIR, pipeline.LDN_GEOJSON), data_dir)
+    tables = pipeline.load_tables(DATA_DIR, os.path.join(DATA_DIR, "store"))
+    datastore.write_store(tables, store_dir)
+
+    engine = RecommenderEngine(data_dir=os.path.join(str(data_dir), ""))
+    venues = engine.df_venues[["Venue", "Venue Latitude"]].copy()
+    expected = engine.recommend(QUERY).recommended_boroughs
+
+    # Fewer venues than the engine maps, in place writes would truncate its files
+    venues_file = str(tmp_path / "venues.csv")
+    tables["venues"].iloc[:500].drop(columns=["Borough", "BoroughLat", "BoroughLon"]).to_csv(
+        venues_file, index=False
+    )
+    pipeline.rebuild(venues_file, str(data_dir), store_dir, chunk_size=100)
+    pipeline.rebuild_groups(str(data_dir), store_dir)
+
+    assert engine.df_venues[["Venue", "Venue Latitude"]].equals(venues)
+    assert engine.group_matrix.sum() > 0
+    engine.result_cache.clear()
+    assert engine.recommend(QUERY).recommended_boroughs == expected
+    assert len(datastore.read_table(store_dir, "venues")) == 500
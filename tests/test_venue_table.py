@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from assets.venue_table import VenueTable, split_filter_part
+
+
+@pytest.mark.parametrize(
+    "value", ["Bridge Street", "Pine tree", "Little Italy", "Sandgate", "The Oval", "Queen Street"]
+)
+def test_operator_words_in_values_are_part_of_the_value(value):
+    assert split_filter_part('{Venue} contains "%s"' % value) == ("Venue", "contains", value)
+
+
+@pytest.mark.parametrize(
+    "part, expected",
+    [
+        ("{Venue} ge Bridge", ("Venue", "ge", "Bridge")),
+        ("{Venue} >= Bridge", ("Venue", "ge", "Bridge")),
+        ('{Venue Category} = "Pub"', ("Venue Category", "eq", "Pub")),
+        ("{Group} != 'Shopping le Mall'", ("Group", "ne", "Shopping le Mall")),
+        ('{Venue} contains "Say \\"gt\\" "', ("Venue", "contains", 'Say "gt" ')),
+        ("{Venue} lt 3", ("Venue", "lt", 3.0)),
+        ("{Venue} like Park", [None, None, None]),
+        ("Venue contains Park", [None, None, None]),
+    ],
+)
+def test_split_filter_part(part, expected):
+    assert split_filter_part(part) == expected
+
+
+def test_filter_keeps_venues_containing_operator_words():
+    names = ["Bridge Street Cafe", "Pine tree", "Little Italy", "The Oval", "Queen Street"]
+    df_venues = pd.DataFrame(
+        {
+            "Borough": "Camden",
+            "Venue": names,
+            "Group": "Eating out",
+            "Venue Category": "Cafe",
+            "Venue Latitude": 51.5,
+            "Venue Longitude": -0.1,
+        }
+    )
+    table = VenueTable(df_venues)
+    rows = table.rows("Camden", ["Eating out"])
+
+    for name in names:
+        kept = table.filter(rows, '{Venue} contains "%s"' % name)
+        assert list(table.columns["Venue"][kept]) == [name]
+    kept = table.filter(rows, '{Venue} contains "Street" && {Venue} ne "Queen Street"')
+    assert list(table.columns["Venue"][kept]) == ["Bridge Street Cafe"]
+    assert np.array_equal(table.filter(rows, ""), rows)
+
+
+def test_csv_has_every_filtered_venue_not_only_a_page():
+    df_venues = pd.DataFrame(
+        {
+            "Borough": "Camden",
+            "Venue": [f"Venue {i}" for i in range(45)],
+            "Group": "Shopping",
+            "Venue Category": "Shop",
+            "Venue Latitude": 51.5,
+            "Venue Longitude": -0.1,
+        }
+    )
+    table = VenueTable(df_venues)
+    rows = table.filter(table.rows("Camden", ["Shopping"]), '{Venue} contains "1"')
+
+    df_csv = pd.read_csv(io.StringIO(table.to_csv(rows)))
+
+    assert list(df_csv.columns) == VenueTable.COLUMNS + ["URL"]
+    assert df_csv["Venue"].tolist() == [f"Venue {i}" for i in range(45) if "1" in str(i)]
+    assert df_csv["URL"].str.endswith("query=51.5,-0.1").all()